@@ -0,0 +1,141 @@
+from lib.util import *
+from lib.resampling import upsample, upsample_chunked
+
+
+def resizem_legacy(A_in, row_new, col_new):
+    """
+    This function is the previous implementation of the upsampling (``resizem``), built with ``numpy.matlib``. It is kept here as a reference
+    for the benchmark of :mod:`lib.resampling`.
+
+    :param A_in: Input matrix.
+    :type A_in: numpy array
+    :param row_new: New number of rows.
+    :type row_new: integer
+    :param col_new: New number of columns.
+    :type col_new: integer
+
+    :return A_out: Resized matrix.
+    :rtype: numpy array
+    """
+    from numpy.matlib import repmat, reshape
+
+    row_rep = row_new // np.shape(A_in)[0]
+    col_rep = col_new // np.shape(A_in)[1]
+    A_out = reshape(
+        repmat(
+            reshape(reshape(repmat((A_in.flatten(order="F")[np.newaxis]), row_rep, 1), (row_new, -1), order="F").T, (-1, 1), order="F"), 1, col_rep
+        ).T,
+        (col_new, row_new),
+        order="F",
+    ).T
+
+    return A_out
+
+
+def reverse_lines_legacy(df):
+    """
+    This function is the previous implementation of :mod:`lib.util.reverse_lines`, which swaps the regions line by line. It is kept here as a
+    reference for the benchmark.
+
+    :param df: Dataframe with columns 'Region_start' and 'Region_end'.
+    :type df: pandas dataframe
+
+    :returns df_final: The same dataframe after the line direction has been reversed.
+    :rtype: pandas dataframe
+    """
+    for idx in df.index:
+        if df.Region_start[idx] > df.Region_end[idx]:
+            df.loc[idx, "Region_start"], df.loc[idx, "Region_end"] = df.loc[idx, "Region_end"], df.loc[idx, "Region_start"]
+    df_final = df
+
+    return df_final
+
+
+def benchmark(function, *args, repeat=3):
+    """
+    This function runs a function several times and returns its result along with the best run time.
+
+    :param function: Function to be timed.
+    :type function: function
+    :param args: Arguments of the function.
+    :param repeat: Number of runs.
+    :type repeat: integer
+
+    :return (result, seconds): Result of the last run and best run time in seconds.
+    :rtype: tuple
+    """
+    best = np.inf
+    for run in range(0, repeat):
+        start = datetime.datetime.now()
+        result = function(*args)
+        best = min(best, (datetime.datetime.now() - start).total_seconds())
+    return result, best
+
+
+def benchmark_upsampling(shape, factor):
+    """
+    This function compares the upsampling of :mod:`lib.resampling` with the previous implementation, and checks that the results are identical.
+
+    :param shape: Number of rows and columns of the input raster.
+    :type shape: tuple(int, int)
+    :param factor: Upsampling factor in both dimensions.
+    :type factor: integer
+
+    :return: The run times are printed.
+    :rtype: None
+    """
+    A_in = np.random.RandomState(0).rand(*shape)
+    row_new, col_new = shape[0] * factor, shape[1] * factor
+
+    A_legacy, t_legacy = benchmark(resizem_legacy, A_in, row_new, col_new)
+    A_new, t_new = benchmark(upsample, A_in, factor, factor)
+    A_chunked, t_chunked = benchmark(upsample_chunked, A_in, factor, factor, np.empty((row_new, col_new)))
+    if not (np.array_equal(A_legacy, A_new) and np.array_equal(A_legacy, A_chunked)):
+        warn("The upsampled rasters differ for the shape " + str(shape), UserWarning)
+
+    print("Upsampling " + str(shape) + " x" + str(factor) + ":")
+    print("  resizem (legacy):  " + str(round(t_legacy, 4)) + " s")
+    print("  upsample:          " + str(round(t_new, 4)) + " s (x" + str(round(t_legacy / t_new, 1)) + ")")
+    print("  upsample_chunked:  " + str(round(t_chunked, 4)) + " s (x" + str(round(t_legacy / t_chunked, 1)) + ")")
+
+
+def benchmark_reverse_lines(n_lines):
+    """
+    This function compares :mod:`lib.util.reverse_lines` with the previous implementation on random lines between 500 regions, and checks
+    that the regions of the lines are identical.
+
+    :param n_lines: Number of lines.
+    :type n_lines: integer
+
+    :return: The run times are printed.
+    :rtype: None
+    """
+    random = np.random.RandomState(0)
+    regions = np.array(["R" + str(i).zfill(3) for i in range(0, 500)])
+    df = pd.DataFrame(
+        {
+            "Region_start": regions[random.randint(0, 500, n_lines)],
+            "Region_end": regions[random.randint(0, 500, n_lines)],
+            "V1_long": random.rand(n_lines),
+            "V1_lat": random.rand(n_lines),
+            "V2_long": random.rand(n_lines),
+            "V2_lat": random.rand(n_lines),
+        }
+    )
+
+    # The legacy function modifies its input, hence it is run on copies
+    df_legacy, t_legacy = benchmark(lambda: reverse_lines_legacy(df.copy()), repeat=1)
+    df_new, t_new = benchmark(reverse_lines, df)
+    if not df_legacy[["Region_start", "Region_end"]].equals(df_new[["Region_start", "Region_end"]]):
+        warn("The reversed lines differ for " + str(n_lines) + " lines", UserWarning)
+
+    print("Reversing " + str(n_lines) + " lines:")
+    print("  reverse_lines (legacy): " + str(round(t_legacy, 4)) + " s")
+    print("  reverse_lines:          " + str(round(t_new, 4)) + " s (x" + str(round(t_legacy / t_new, 1)) + ")")
+
+
+if __name__ == "__main__":
+    for shape in [(240, 480), (1200, 2400), (2400, 4800)]:
+        benchmark_upsampling(shape, 2)
+    for n_lines in [1000, 10000]:
+        benchmark_reverse_lines(n_lines)
@@ -14,6 +14,7 @@ def configuration():
     paths, param = scope_paths_and_parameters(paths, param)
 
     param = resolution_parameters(param)
+    param = spatial_processing_parameters(param)
     param = load_parameters(param)
     param = grid_parameters(param)
     param = processes_parameters(param)
@@ -37,6 +38,18 @@ def general_settings():
     This function creates and initializes the dictionaries param and paths. It also creates global variables for the root folder ``root``
     and the system-dependent file separator ``fs``.
 
+    The dictionary *intermediate* defines how the large intermediate time series (load and renewable time series) are saved:
+
+      * *format* is either ``'hdf5'`` (binary files, faster to read and write, and keeping the data types) or ``'csv'``.
+      * *csv_export*, if True, saves a human-readable CSV copy of each intermediate file in addition to the HDF5 file.
+      * *ts_dtype* is the data type of the time series, either ``'float64'`` or ``'float32'``. With ``'float32'``, the time series are stored and
+        calculated in single precision, which halves their memory use. Yearly sums are always calculated in double precision.
+
+    The dictionary *source_cache* defines whether the large raw inputs (Excel files and large CSV files) are cached after being parsed:
+
+      * *enabled*, if True, saves each parsed raw input as an HDF5 file in the folder *source_cache*, which is read instead of the raw input
+        in the next runs, as long as the raw input does not change (see :mod:`lib.util.read_source`).
+
     :return (paths, param): The empty dictionary paths, and the dictionary param including some general information.
     :rtype: tuple(dict, dict)
     """
@@ -47,6 +60,8 @@ def general_settings():
     param = {}
     param["author"] = "Kais Siala"  # the name of the person running the script
     param["comment"] = "Europe"
+    param["intermediate"] = {"format": "hdf5", "csv_export": False, "ts_dtype": "float64"}  # format: 'hdf5' or 'csv'
+    param["source_cache"] = {"enabled": True}
 
     paths = {}
     fs = os.path.sep
@@ -131,10 +146,50 @@ def resolution_parameters(param):
     return param
 
 
+def spatial_processing_parameters(param):
+    """
+    This function defines how the regions are rasterized, how the zonal statistics are computed, and how the local maps are saved.
+
+      * *zonal_stats* is a dictionary with the key *mode*. In the mode ``'label'``, all the regions are rasterized at once into a raster of
+        region IDs, and the statistics for all the regions are computed in one pass. In the mode ``'region'``, each region is rasterized
+        and evaluated on its own, which is slower but needs less memory for very large scopes. In that mode, *workers* sets the number of
+        processes among which the regions are distributed. Both modes give identical statistics.
+      * *mask_cache* is a dictionary with the keys *enabled* and *max_size_MB*. If enabled, the masks of the regions are saved on disk after
+        being rasterized once, and reused by the later stages and runs with the same regions and resolution. It is used for the masks of single
+        regions, i.e. by :mod:`lib.generate_intermediate_files.generate_sites_from_shapefile`, by the distribution of renewable power plants, and
+        by *zonal_stats* in the mode ``'region'``. The land and sea rasters and the mode ``'label'`` rasterize all regions at once and do not use it.
+        The least recently used masks are deleted when the cache exceeds *max_size_MB*.
+      * *raster_output* is a dictionary with the keys *compression* and *overviews*, used to save the local maps. The compression can be
+        ``'DEFLATE'``, ``'ZSTD'`` (if supported by the GDAL installation), ``'LZW'`` or ``'PACKBITS'``. *overviews* is a list of decimation
+        factors, e.g. ``[2, 4, 8, 16]``, which speed up the display of large maps in GIS software. No overviews are built if it is empty.
+      * *locator* is a dictionary with the key *tolerance*, used to locate points (line ends, power plants) in the subregions. If the tolerance
+        is greater than 0 (in degrees), the subregions are simplified before locating the points, which is faster but less accurate near the borders.
+
+    :param param: Dictionary including the user preferences.
+    :type param: dict
+
+    :return param: The updated dictionary param.
+    :rtype: dict
+    """
+
+    param["zonal_stats"] = {"mode": "label", "workers": 1}  # mode: 'label' or 'region'
+    param["mask_cache"] = {"enabled": True, "max_size_MB": 1024}
+    param["raster_output"] = {"compression": "DEFLATE", "overviews": []}
+    param["locator"] = {"tolerance": 0}
+    return param
+
+
 def load_parameters(param):
     """
-    This function defines the user preferences which are related to the load/demand. Currently, only one parameter is used, namely
-    *default_sec_shares*, which sets the reference region to be used in case data for other regions is missing.
+    This function defines the user preferences which are related to the load/demand:
+
+      * *default_sec_shares* sets the reference region to be used in case data for other regions is missing.
+      * *years* is the list of years of data for which the load is generated in one run. The spatial statistics are computed once for all the years,
+        and the outputs are saved for each year. By default, only *year* is used.
+      * *subregions_dense*, if True, saves the load time series of the subregions in the file *load_regions*. Otherwise, only their factors are saved
+        (see :mod:`lib.util.save_load_factors`), and the time series are computed from them when they are needed.
+      * *registry_on_disk*, if True, saves the cleaned load profiles of the profile registry in the folder *profile_registry* (see
+        :mod:`lib.util.publish_profile`), so that the raw standard load profiles are only parsed again when they change.
 
     :param param: Dictionary including the user preferences.
     :type param: dict
@@ -143,7 +198,7 @@ def load_parameters(param):
     :rtype: dict
     """
 
-    param["load"] = {"default_sec_shares": "DEU"}
+    param["load"] = {"default_sec_shares": "DEU", "years": [param["year"]], "subregions_dense": False, "registry_on_disk": True}
     return param
 
 
@@ -170,6 +225,8 @@ def grid_parameters(param):
     
       * *quality* is a user assessment of the quality of the data. If the data is trustworthy, use 1, if it is not trustworthy at all, use 0. You can use values inbetween.
       * *default* is a collection of default values for voltage, wires, cables, and frequency, to use when these data are missing.
+      * *chunk_rows* is the number of rows of the raw GridKit file that are read and parsed at once.
+      * *neighbors_cache*, if True, saves the pairs of neighboring subregions in the folder *grid_sub*, to be reused as long as the subregions do not change.
 
     :param param: Dictionary including the user preferences.
     :type param: dict
@@ -181,6 +238,8 @@ def grid_parameters(param):
     param["grid"] = {
         "quality": {"voltage": 1, "wires": 0, "cables": 0.5, "frequency": 0},
         "default": {"voltage": 220000, "wires": 1, "cables": 3, "frequency": 50},
+        "chunk_rows": 100000,
+        "neighbors_cache": True,
     }
 
     return param
@@ -202,6 +261,8 @@ def processes_parameters(param):
         otherwise all the power plants will be located in a small area of high potential, close to each other.
       * *default_pa_type* and *default_pa_availability* are two arrays defining the availability for each type of protected land. These arrays are used as default, along
         with the protected areas raster, in case no potential map is available for a distributed renewable technology.
+      * *seed* is the seed of the random numbers used for the distribution, so that the locations of the power plants are reproducible. Set it to
+        ``None`` to get different locations at every run.
 
     :param param: Dictionary including the user preferences.
     :type param: dict
@@ -217,6 +278,7 @@ def processes_parameters(param):
         "randomness": 0.99,
         "default_pa_type": np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]),
         "default_pa_availability": np.array([1.00, 0.00, 0.00, 0.00, 0.00, 0.00, 0.25, 1.00, 1.00, 1.00, 1.00]),
+        "seed": 0,
     }
 
     return param
@@ -598,6 +660,7 @@ def output_folders(paths, param):
       * *proc_sub* is the output folder for the subregions-dependent, process-related intermediate files.
       * *urbs* is the output folder for the urbs model input file.
       * *evrys* is the output folder for the evrys model input files.
+      * *source_cache* is the folder of the parsed raw inputs, shared by all the regions.
       
     All the folders are created at the beginning of the calculation, if they do not already exist.
     
@@ -617,6 +680,11 @@ def output_folders(paths, param):
     # Main output folder
     paths["region"] = root + "03 Intermediate files" + fs + "Files " + region + fs
 
+    # Cache of parsed raw inputs
+    paths["source_cache"] = root + "03 Intermediate files" + fs + "Source cache" + fs
+    if not os.path.isdir(paths["source_cache"]):
+        os.makedirs(paths["source_cache"])
+
     # Output folder for local maps of the scope
     paths["local_maps"] = paths["region"] + "Maps" + fs
     if not os.path.isdir(paths["local_maps"]):
@@ -674,6 +742,7 @@ def output_paths(paths, param):
       * *stats_countries* is the CSV output file listing some load statistics on a country level.
       * *load_ts_clean* is the CSV output file with cleaned load time series on a country level.
       * *cleaned_profiles* is a dictionary of paths to the CSV file with cleaned load profiles for each sector.
+      * *profile_registry* is the folder where the cleaned load profiles of the profile registry are saved.
       * *df_sector* is the CSV output file with load time series for each sector on a country level.
       * *load_sector* is the CSV output file with yearly electricity demand for each sector and country.
       * *load_landuse* is the CSV output file with load time series for each land use type on a country level.
@@ -726,23 +795,12 @@ def output_paths(paths, param):
 
     # Load
     paths["stats_countries"] = paths["load"] + "Statistics_countries.csv"
-    paths["sector_shares_clean"] = paths["load"] + "Sector_shares_" + year + ".csv"
-    paths["load_ts_clean"] = paths["load"] + "TS_countries_clean_" + year + ".csv"
-    paths["df_sector"] = paths["load"] + "TS_countries_sectors_" + year + ".csv"
-    paths["load_sector"] = paths["load"] + "Yearly_demand_countries_sectors_" + year + ".csv"
-    paths["load_landuse"] = paths["load"] + "TS_countries_land_use_" + year + ".csv"
     paths["intersection_subregions_countries"] = paths["load_sub"] + "Intersection_with_" + param["subregions_name"] + ".shp"
     paths["stats_country_parts"] = paths["load_sub"] + "Statistics_country_parts.csv"
-    paths["load_regions"] = paths["load_sub"] + "TS_subregions_" + param["subregions_name"] + "_" + year + ".csv"
+    paths = load_year_paths(paths, param, param["year"])
 
-    # Cleaned load profiles
-    paths["cleaned_profiles"] = {
-        "RES": paths["load"] + "Residential_Load_profiles.csv",
-        "IND": paths["load"] + "Industry_Load_profiles.csv",
-        "COM": paths["load"] + "Commercial_Load_profiles.csv",
-        "AGR": paths["load"] + "Agriculture_Load_profiles.csv",
-        "STR": paths["load"] + "Streetlight_Load_profiles.csv",
-    }
+    # Registry of cleaned load profiles
+    paths["profile_registry"] = paths["load"] + "Profiles" + fs
 
     # Grid
     paths["grid_expanded"] = paths["grid"] + "grid_expanded.csv"
@@ -781,6 +839,48 @@ def output_paths(paths, param):
     return paths
 
 
+def load_year_paths(paths, param, year):
+    """
+    This function defines the paths of the load-related files that depend on the year of the data:
+
+      * *sector_shares_clean* and *load_ts_clean* are the cleaned sector shares and load time series of the countries.
+      * *df_sector*, *load_sector*, and *load_landuse* are the sectoral load time series, the yearly demand per sector, and the load time series
+        per land use pixel and per person in each country.
+      * *load_regions* and *load_regions_factors* are the load time series of the subregions and their factors.
+      * *cleaned_profiles* is a dictionary of paths to the CSV files with the cleaned load profiles of each sector.
+
+    It is called by :mod:`output_paths` for *year*, and by :mod:`lib.generate_intermediate_files.generate_load_timeseries` for each year of
+    *years* in *load*.
+
+    :param paths: Dictionary including the paths to the folders *load* and *load_sub*.
+    :type paths: dict
+    :param param: Dictionary including the user preference *subregions_name*.
+    :type param: dict
+    :param year: Year of the data.
+    :type year: integer
+
+    :return paths: The updated dictionary paths.
+    :rtype: dict
+    """
+    year = str(year)
+    paths["sector_shares_clean"] = paths["load"] + "Sector_shares_" + year + ".csv"
+    paths["load_ts_clean"] = paths["load"] + "TS_countries_clean_" + year + ".csv"
+    paths["df_sector"] = paths["load"] + "TS_countries_sectors_" + year + ".csv"
+    paths["load_sector"] = paths["load"] + "Yearly_demand_countries_sectors_" + year + ".csv"
+    paths["load_landuse"] = paths["load"] + "TS_countries_land_use_" + year + ".csv"
+    paths["load_regions"] = paths["load_sub"] + "TS_subregions_" + param["subregions_name"] + "_" + year + ".csv"
+    paths["load_regions_factors"] = paths["load_sub"] + "TS_subregions_" + param["subregions_name"] + "_" + year + "_factors.npz"
+    paths["cleaned_profiles"] = {
+        "RES": paths["load"] + "Residential_Load_profiles_" + year + ".csv",
+        "IND": paths["load"] + "Industry_Load_profiles_" + year + ".csv",
+        "COM": paths["load"] + "Commercial_Load_profiles_" + year + ".csv",
+        "AGR": paths["load"] + "Agriculture_Load_profiles_" + year + ".csv",
+        "STR": paths["load"] + "Streetlight_Load_profiles_" + year + ".csv",
+    }
+
+    return paths
+
+
 def local_maps_paths(paths, param):
     """
     This function defines the paths where the local maps will be saved:
@@ -790,6 +890,7 @@ def local_maps_paths(paths, param):
       * *LU* for the land use raster within the scope
       * *PA* for the raster of protected areas within the scope
       * *POP* for the population raster within the scope
+      * *mask_cache* for the folder of cached region masks
     
     :param paths: Dictionary including the paths.
     :type paths: dict
@@ -807,5 +908,6 @@ def local_maps_paths(paths, param):
     paths["LU"] = PathTemp + "_Landuse.tif"  # Land use types
     paths["PA"] = PathTemp + "_Protected_areas.tif"  # Protected areas
     paths["POP"] = PathTemp + "_Population.tif"  # Population
+    paths["mask_cache"] = paths["local_maps"] + "Masks" + fs  # Cached region masks
 
     return paths
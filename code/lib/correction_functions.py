@@ -1,103 +1,78 @@
 from lib.spatial_functions import create_shapefiles_of_ren_power_plants
 from lib.util import *
+from lib.geodesic import geodesic_distance
+from config import load_year_paths
 
 
-def clean_residential_load_profile(paths, param):
+def calendar_of_year(paths, year):
     """
-    This function reads the raw standard residential profile, repeats it to obtain a full year, normalizes it so that the
-    sum is equal to 1, and saves the obtained load profile in a CSV file.
-    
-    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
+    This function returns the calendar of a year, with the type of each day (working day, Saturday, or Sunday) according to *dict_daytype*,
+    and its season according to *dict_season*. Leap years have 366 days. The calendar also contains the day of the year in a reference year
+    of 365 days, in which February 29 is replaced with February 28, so that profiles of 365 days can be used for all years.
+
+    :param paths: Dictionary containing the paths to *dict_daytype* and *dict_season*.
     :type paths: dict
-    :param param: Dictionary containing the year of the data.
-    :type param: dict
-    
-    :return: The outputs are saved in CSV in the defined paths, along with their metadata in JSON files.
-    :rtype: None
+    :param year: Year of the calendar.
+    :type year: integer
+
+    :return calendar: Dataframe with one row per day and the columns *Date*, *Day*, *Season*, and *Reference day*.
+    :rtype: pandas dataframe
     """
-    timecheck("Start")
-    profile = pd.DataFrame(columns=["RES"])
     dict_daytype = pd.read_csv(paths["dict_daytype"], sep=";", decimal=",", index_col=["Week day"])["Type"].to_dict()
     dict_season = pd.read_csv(paths["dict_season"], sep=";", decimal=",", index_col=["Month"])["Season"].to_dict()
-    list_sectors = list(pd.read_csv(paths["dict_sectors"], sep=";", decimal=",", index_col=["Model_sectors"]).index.dropna().unique())
-    profiles_paths = paths["profiles"]
-
-    # Prepare the dataframe for the daily load
-    start = datetime.datetime(param["year"], 1, 1)
-    end = datetime.datetime(param["year"], 12, 31)
-    hours = [str(x) for x in list(range(0, 24))]
-    time_series = pd.DataFrame(data=np.zeros((365, 27)), index=None, columns=["Date", "Day", "Season"] + hours)
-    time_series["Date"] = pd.date_range(start, end)
-    time_series["Day"] = [dict_daytype[time_series.loc[i, "Date"].day_name()] for i in time_series.index]
-    time_series["Season"] = [dict_season[time_series.loc[i, "Date"].month] for i in time_series.index]
-    hours = [str(x) for x in list(range(0, 24))]
 
-    # Residential load
-    residential_profile_raw = pd.read_excel(paths["profiles"]["RES"], header=[3, 4], skipinitialspace=True)
-    residential_profile_raw.rename(
-        columns={"Übergangszeit": "Spring/Fall", "Sommer": "Summer", "Werktag": "Working day", "Sonntag/Feiertag": "Sunday", "Samstag": "Saturday"},
-        inplace=True,
-    )
-    residential_profile = time_series.copy()
-    for i in residential_profile.index:
-        residential_profile.loc[i, hours] = list(residential_profile_raw[(residential_profile.loc[i, "Season"], residential_profile.loc[i, "Day"])])
+    dates = pd.Series(pd.date_range(datetime.datetime(year, 1, 1), datetime.datetime(year, 12, 31)))
+    calendar = pd.DataFrame({"Date": dates, "Day": dates.dt.day_name().map(dict_daytype), "Season": dates.dt.month.map(dict_season)})
+    calendar["Reference day"] = dates.dt.dayofyear - 1 - ((dates.dt.is_leap_year) & (dates.dt.dayofyear >= 60)).astype(int)
+    return calendar
 
-    # Reshape the hourly load in one vector, where the rows are the hours of the year
-    residential_profile = np.reshape(residential_profile.loc[:, hours].values, -1, order="C")
-    profile["RES"] = residential_profile / residential_profile.sum()
 
-    # Save Profile
-    profile.to_csv(paths["cleaned_profiles"]["RES"], sep=";", decimal=",")
-    print("File Saved: " + paths["cleaned_profiles"]["RES"])
-    create_json(
-        paths["cleaned_profiles"]["RES"],
-        param,
-        ["region_name", "subregions_name", "year", "load"],
-        paths,
-        ["profiles", "dict_daytype", "dict_season"],
-    )
-    timecheck("End")
+def expand_daily_profiles(daily, codes):
+    """
+    This function expands daily profiles into profiles for whole years. All the profiles are expanded at once by gathering the daily profile
+    of each day and sector, then reshaping the result so that the rows are the hours of the year.
 
+    :param daily: Daily profiles, where each row is a profile of 24 hours.
+    :type daily: numpy array
+    :param codes: Row of *daily* to be used for each day (rows) and each profile (columns).
+    :type codes: numpy array
 
-def clean_industry_load_profile(paths, param):
+    :return profiles: Hourly profiles, where the rows are the hours of the year and the columns correspond to the columns of *codes*.
+    :rtype: numpy array
     """
-    This function reads the raw standard industrial profile, repeats it to obtain a full year, normalizes it so that the
-    sum is equal to 1, and saves the obtained load profile in a CSV file.
+    n_days, n_profiles = codes.shape
+    return daily[codes].transpose((0, 2, 1)).reshape((n_days * 24, n_profiles))
 
-    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
-    :type paths: dict
-    :param param: Dictionary containing the year of the data.
-    :type param: dict
 
-    :return: The outputs are saved in CSV in the defined paths, along with their metadata in JSON files.
-    :rtype: None
+def hourly_from_quarter_hours(profile_raw, time_column):
     """
-    timecheck("Start")
-    profile = pd.DataFrame(columns=["IND"])
-    industrial_profile_raw = pd.read_excel(paths["profiles"]["IND"], header=0)
-    industrial_profile_raw.rename(columns={"Stunde": "Hour", "Last": "Load"}, inplace=True)
+    This function aggregates a load profile with a resolution of 15 minutes to an hourly resolution. The hour of each row is given by the
+    first two characters of *time_column*, as in the raw standard load profiles.
 
-    # Reshape the hourly load in one vector, where the rows are the hours of the year
-    industrial_profile = np.tile(industrial_profile_raw["Load"].values, 365)
-    profile["IND"] = industrial_profile / industrial_profile.sum()
+    :param profile_raw: Raw load profile, with one row per quarter hour.
+    :type profile_raw: pandas dataframe
+    :param time_column: Name of the column with the time of the day.
+    :type time_column: string or tuple
 
-    # Save Profile
-    profile.to_csv(paths["cleaned_profiles"]["IND"], sep=";", decimal=",")
-    print("File Saved: " + paths["cleaned_profiles"]["IND"])
-    create_json(
-        paths["cleaned_profiles"]["RES"],
-        param,
-        ["region_name", "subregions_name", "year", "load"],
-        paths,
-        ["profiles", "dict_daytype", "dict_season"],
-    )
-    timecheck("End")
+    :return profile_hourly: Load profile with one row per hour.
+    :rtype: pandas dataframe
+    """
+    hours = profile_raw[time_column].astype(str).str[:2].astype(int).values
+    return profile_raw.drop(columns=[time_column]).groupby(hours).sum()
 
 
-def clean_commercial_load_profile(paths, param):
+def clean_load_profiles(paths, param):
     """
-    This function reads the raw standard commercial profile, repeats it to obtain a full year, normalizes it so that the
-    sum is equal to 1, and saves the obtained load profile in a CSV file.
+    This function reads the raw standard load profiles of the five sectors, repeats them to obtain a full year, normalizes them so that
+    the sum of each profile is equal to 1, and saves the obtained load profiles in CSV files:
+
+      * Residential, commercial and agricultural profiles depend on the season and on the type of day (working day, Saturday, Sunday).
+      * The industrial profile is the same for all days.
+      * The street light profile is given for each day of a reference year of 365 days.
+
+    The calendar of the year (see :mod:`calendar_of_year`) is built once, leap years included, and the daily profiles of all the sectors are
+    expanded together with :mod:`expand_daily_profiles`. The profiles are published in the profile registry (see :mod:`lib.util.publish_profile`),
+    and the raw profiles are not parsed again if the registry already contains the profiles of the year for the same source files.
 
     :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
     :type paths: dict
@@ -108,191 +83,194 @@ def clean_commercial_load_profile(paths, param):
     :rtype: None
     """
     timecheck("Start")
-    profile = pd.DataFrame(columns=["COM"])
-    dict_daytype = pd.read_csv(paths["dict_daytype"], sep=";", decimal=",", index_col=["Week day"])["Type"].to_dict()
-    dict_season = pd.read_csv(paths["dict_season"], sep=";", decimal=",", index_col=["Month"])["Season"].to_dict()
+    sectors = ["RES", "COM", "AGR", "IND", "STR"]
+
+    # The raw profiles are only parsed again if they or the calendar dictionaries have changed
+    if all((lookup_profile(paths, param, sector) is not None) and os.path.isfile(paths["cleaned_profiles"][sector]) for sector in sectors):
+        print("The cleaned load profiles of " + str(param["year"]) + " are up to date.")
+        timecheck("End")
+        return
+
+    calendar = calendar_of_year(paths, param["year"])
+    renamed = {
+        "Übergangszeit": "Spring/Fall",
+        "Ãœbergangszeit": "Spring/Fall",
+        "Sommer": "Summer",
+        "Werktag": "Working day",
+        "Sonntag/Feiertag": "Sunday",
+        "Sonntag": "Sunday",
+        "Samstag": "Saturday",
+    }
 
-    # Prepare the dataframe for the daily load
-    start = datetime.datetime(param["year"], 1, 1)
-    end = datetime.datetime(param["year"], 12, 31)
-    hours = [str(x) for x in list(range(0, 24))]
-    time_series = pd.DataFrame(data=np.zeros((365, 27)), index=None, columns=["Date", "Day", "Season"] + hours)
-    time_series["Date"] = pd.date_range(start, end)
-    time_series["Day"] = [dict_daytype[time_series.loc[i, "Date"].day_name()] for i in time_series.index]
-    time_series["Season"] = [dict_season[time_series.loc[i, "Date"].month] for i in time_series.index]
-    hours = [str(x) for x in list(range(0, 24))]
-
-    commercial_profile_raw = pd.read_csv(
-        paths["profiles"]["COM"], sep="[;]", engine="python", decimal=",", skiprows=[0, 99], header=[0, 1], skipinitialspace=True
-    )
-    commercial_profile_raw.rename(
-        columns={"Ãœbergangszeit": "Spring/Fall", "Sommer": "Summer", "Werktag": "Working day", "Sonntag": "Sunday", "Samstag": "Saturday"},
-        inplace=True,
-    )
+    # Residential load
+    residential_profile_raw = read_source(paths, param, pd.read_excel, paths["profiles"]["RES"], header=[3, 4], skipinitialspace=True)
+    residential_profile_raw.rename(columns=renamed, inplace=True)
 
-    # Aggregate from 15 min --> hourly load
-    commercial_profile_raw[("Hour", "All")] = [int(str(commercial_profile_raw.loc[i, ("G0", "[W]")])[:2]) for i in commercial_profile_raw.index]
-    commercial_profile_raw = commercial_profile_raw.groupby([("Hour", "All")]).sum()
-    commercial_profile_raw.reset_index(inplace=True)
-    commercial_profile = time_series.copy()
-    for i in commercial_profile.index:
-        commercial_profile.loc[i, hours] = list(commercial_profile_raw[(commercial_profile.loc[i, "Season"], commercial_profile.loc[i, "Day"])])
-
-    # Reshape the hourly load in one vector, where the rows are the hours of the year
-    commercial_profile = np.reshape(commercial_profile.loc[:, hours].values, -1, order="C")
-    profile["COM"] = commercial_profile / commercial_profile.sum()
-
-    # Save Profile
-    profile.to_csv(paths["cleaned_profiles"]["COM"], sep=";", decimal=",")
-    print("File Saved: " + paths["cleaned_profiles"]["COM"])
-    create_json(
-        paths["cleaned_profiles"]["RES"],
+    # Commercial and agricultural load, aggregated from 15 min --> hourly load
+    commercial_profile_raw = read_source(
+        paths,
         param,
-        ["region_name", "subregions_name", "year", "load"],
+        pd.read_csv,
+        paths["profiles"]["COM"],
+        sep="[;]",
+        engine="python",
+        decimal=",",
+        skiprows=[0, 99],
+        header=[0, 1],
+        skipinitialspace=True,
+    )
+    commercial_profile_raw.rename(columns=renamed, inplace=True)
+    commercial_profile_raw = hourly_from_quarter_hours(commercial_profile_raw, ("G0", "[W]"))
+    agricultural_profile_raw = read_source(
         paths,
-        ["profiles", "dict_daytype", "dict_season"],
+        param,
+        pd.read_csv,
+        paths["profiles"]["AGR"],
+        sep="[;]",
+        engine="python",
+        decimal=",",
+        skiprows=[0, 99],
+        header=[0, 1],
+        skipinitialspace=True,
     )
-    timecheck("End")
-
-
-def clean_agriculture_load_profile(paths, param):
-    """
-    This function reads the raw standard agricultural profile, repeats it to obtain a full year, normalizes it so that the
-    sum is equal to 1, and saves the obtained load profile in a CSV file.
-
-    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
-    :type paths: dict
-    :param param: Dictionary containing the year of the data.
-    :type param: dict
+    agricultural_profile_raw.rename(columns=renamed, inplace=True)
+    agricultural_profile_raw = hourly_from_quarter_hours(agricultural_profile_raw, ("L0", "[W]"))
 
-    :return: The outputs are saved in CSV in the defined paths, along with their metadata in JSON files.
-    :rtype: None
-    """
-    timecheck("Start")
-    profile = pd.DataFrame(columns=["AGR"])
-    dict_daytype = pd.read_csv(paths["dict_daytype"], sep=";", decimal=",", index_col=["Week day"])["Type"].to_dict()
-    dict_season = pd.read_csv(paths["dict_season"], sep=";", decimal=",", index_col=["Month"])["Season"].to_dict()
+    # Industrial load
+    industrial_profile_raw = read_source(paths, param, pd.read_excel, paths["profiles"]["IND"], header=0)
+    industrial_profile_raw.rename(columns={"Stunde": "Hour", "Last": "Load"}, inplace=True)
 
-    # Prepare the dataframe for the daily load
-    start = datetime.datetime(param["year"], 1, 1)
-    end = datetime.datetime(param["year"], 12, 31)
-    hours = [str(x) for x in list(range(0, 24))]
-    time_series = pd.DataFrame(data=np.zeros((365, 27)), index=None, columns=["Date", "Day", "Season"] + hours)
-    time_series["Date"] = pd.date_range(start, end)
-    time_series["Day"] = [dict_daytype[time_series.loc[i, "Date"].day_name()] for i in time_series.index]
-    time_series["Season"] = [dict_season[time_series.loc[i, "Date"].month] for i in time_series.index]
-    hours = [str(x) for x in list(range(0, 24))]
-
-    agricultural_profile_raw = pd.read_csv(
-        paths["profiles"]["AGR"], sep="[;]", engine="python", decimal=",", skiprows=[0, 99], header=[0, 1], skipinitialspace=True
-    )
-    agricultural_profile_raw.rename(
-        columns={"Ãœbergangszeit": "Spring/Fall", "Sommer": "Summer", "Werktag": "Working day", "Sonntag": "Sunday", "Samstag": "Saturday"},
-        inplace=True,
+    # Street lights, aggregated from 15 min --> hourly load
+    streets_profile_raw = read_source(paths, param, pd.read_excel, paths["profiles"]["STR"], header=[4], skipinitialspace=True, usecols=[0, 1, 2])
+    streets_profile_raw["Hour"] = streets_profile_raw["Uhrzeit"].astype(str).str[:2].astype(int)
+    streets_profile_raw = streets_profile_raw.groupby(["Datum", "Hour"]).sum()
+    streets_profile_raw.iloc[0] = streets_profile_raw.iloc[0] + streets_profile_raw.iloc[-1]
+    streets_profile_raw = streets_profile_raw.iloc[:-1]
+    streets_daily = np.reshape(streets_profile_raw.values, (-1, 24))
+
+    # Table of all the daily profiles, and the row of that table to be used for each day and sector
+    day_types = calendar[["Season", "Day"]].drop_duplicates()
+    day_codes = calendar.groupby(["Season", "Day"], sort=False).ngroup().values
+    daily = [
+        np.stack([profile_raw[(season, day)].values for season, day in day_types.values])
+        for profile_raw in [residential_profile_raw, commercial_profile_raw, agricultural_profile_raw]
+    ]
+    daily = daily + [industrial_profile_raw["Load"].values[np.newaxis, :], streets_daily]
+    offsets = np.cumsum([0] + [len(d) for d in daily[:-1]])
+    codes = np.stack(
+        [
+            day_codes + offsets[0],
+            day_codes + offsets[1],
+            day_codes + offsets[2],
+            np.full(len(calendar), offsets[3]),
+            calendar["Reference day"].values + offsets[4],
+        ],
+        axis=1,
     )
+    profiles = expand_daily_profiles(np.concatenate(daily).astype(float), codes)
 
-    # Aggregate from 15 min --> hourly load
-    agricultural_profile_raw["Hour"] = [int(str(agricultural_profile_raw.loc[i, ("L0", "[W]")])[:2]) for i in agricultural_profile_raw.index]
-    agricultural_profile_raw = agricultural_profile_raw.groupby(["Hour"]).sum()
-    agricultural_profile = time_series.copy()
-    for i in agricultural_profile.index:
-        agricultural_profile.loc[i, hours] = list(
-            agricultural_profile_raw[(agricultural_profile.loc[i, "Season"], agricultural_profile.loc[i, "Day"])]
+    # Normalize the load over the year, ei. integral over the year of all loads for each individual sector is 1
+    profiles = profiles / profiles.sum(axis=0)
+
+    # Publish profiles in the registry and save them
+    for i, sector in enumerate(sectors):
+        publish_profile(paths, param, sector, profiles[:, i])
+        profile = pd.DataFrame(profiles[:, i], columns=[sector])
+        profile.to_csv(paths["cleaned_profiles"][sector], sep=";", decimal=",")
+        print("File Saved: " + paths["cleaned_profiles"][sector])
+        create_json(
+            paths["cleaned_profiles"][sector],
+            param,
+            ["region_name", "subregions_name", "year", "load"],
+            paths,
+            ["profiles", "dict_daytype", "dict_season"],
         )
-
-    # Reshape the hourly load in one vector, where the rows are the hours of the year
-    agricultural_profile = np.reshape(agricultural_profile.loc[:, hours].values, -1, order="C")
-    profile["AGR"] = agricultural_profile / agricultural_profile.sum()
-
-    # Save Profile
-    profile.to_csv(paths["cleaned_profiles"]["AGR"], sep=";", decimal=",")
-    print("File Saved: " + paths["cleaned_profiles"]["AGR"])
-    create_json(
-        paths["cleaned_profiles"]["RES"],
-        param,
-        ["region_name", "subregions_name", "year", "load"],
-        paths,
-        ["profiles", "dict_daytype", "dict_season"],
-    )
     timecheck("End")
 
 
-def clean_streetlight_load_profile(paths, param):
+def fill_load_gaps(df_load):
     """
-    This function reads the raw standard street light profile, repeats it to obtain a full year, normalizes it so that the
-    sum is equal to 1, and saves the obtained load profile in a CSV file.
-
-    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
-    :type paths: dict
-    :param param: Dictionary containing the year of the data.
-    :type param: dict
-
-    :return: The outputs are saved in CSV in the defined paths, along with their metadata in JSON files.
-    :rtype: None
-    """
-    timecheck("Start")
-    profile = pd.DataFrame(columns=["STR"])
-    streets_profile_raw = pd.read_excel(paths["profiles"]["STR"], header=[4], skipinitialspace=True, usecols=[0, 1, 2])
-
-    # Aggregate from 15 min --> hourly load
-    streets_profile_raw["Hour"] = [int(str(streets_profile_raw.loc[i, "Uhrzeit"])[:2]) for i in streets_profile_raw.index]
-    streets_profile_raw = streets_profile_raw.groupby(["Datum", "Hour"]).sum()
-    streets_profile_raw.iloc[0] = streets_profile_raw.iloc[0] + streets_profile_raw.iloc[-1]
-    streets_profile_raw = streets_profile_raw.iloc[:-1]
+    This function fills the missing values (zeros) of hourly load time series by the value of the same hour of the day before, adjusted based
+    on the trend of the five hours before the gap: the sum of these five hours is divided by the sum of the same five hours of the day before.
+    All the gaps are filled at once with rolling sums:
 
-    # Reshape the hourly load in one vector, where the rows are the hours of the year
-    streets_profile = streets_profile_raw.values
+      * The trend is calculated once for each gap (a series of consecutive missing hours), and used for all its hours. If the five hours
+        before the gap or the same hours of the day before are not available (start of the series, other gaps, or zero load), the trend is 1.
+      * Gaps of more than 24 hours are filled in several passes, each of them using the values of the day before that have been filled in the
+        previous pass.
+      * Missing hours of the first day, which have no day before, are filled with the same hour of the first following day with data.
 
-    # Normalize the load over the year, ei. integral over the year of all loads for each individual sector is 1
-    profile["STR"] = np.concatenate((streets_profile / streets_profile.sum()))
+    :param df_load: Hourly load time series, where the rows are the hours and the columns the countries.
+    :type df_load: pandas dataframe
 
-    # Save Profile
-    profile.to_csv(paths["cleaned_profiles"]["STR"], sep=";", decimal=",")
-    print("File Saved: " + paths["cleaned_profiles"]["STR"])
-    create_json(
-        paths["cleaned_profiles"]["RES"],
-        param,
-        ["region_name", "subregions_name", "year", "load"],
-        paths,
-        ["profiles", "dict_daytype", "dict_season"],
-    )
-    timecheck("End")
+    :return df_filled: Load time series without gaps.
+    :rtype: pandas dataframe
+    """
+    load = df_load.values.astype(float)
+    missing = load == 0
+    n_hours, n_countries = load.shape
+    hours = np.arange(n_hours)
+
+    # Rolling sums of the five hours before each hour, and number of missing hours in that window
+    load_sum = np.concatenate((np.zeros((1, n_countries)), np.cumsum(load, axis=0)))
+    missing_sum = np.concatenate((np.zeros((1, n_countries)), np.cumsum(missing, axis=0)))
+    before = np.clip(hours - 5, 0, None)
+    rolling = load_sum[hours] - load_sum[before]
+    rolling_missing = (missing_sum[hours] - missing_sum[before]) + (hours < 5)[:, np.newaxis]
+
+    # Trend at the first hour of each gap, compared with the day before
+    valid = (hours >= 29)[:, np.newaxis] & (rolling_missing == 0)
+    valid[29:] = valid[29:] & (rolling_missing[5:-24] == 0) & (rolling[5:-24] > 0)
+    trend = np.ones((n_hours, n_countries))
+    trend[29:] = np.where(valid[29:], rolling[29:] / np.where(valid[29:], rolling[5:-24], 1), 1)
+
+    # Use the trend of the first hour of the gap for all its hours
+    start = missing & ~np.concatenate((np.zeros((1, n_countries), dtype=bool), missing[:-1]))
+    gap_start = np.maximum.accumulate(np.where(start, hours[:, np.newaxis], 0), axis=0)
+    trend = trend[gap_start, np.arange(n_countries)]
+
+    # Fill the gaps of the first day with the same hour of the first following day with data
+    filled = load.copy()
+    pending = missing.copy()
+    n_days = n_hours // 24
+    days_valid = ~missing[: n_days * 24].reshape((n_days, 24, n_countries))
+    first_valid = days_valid.argmax(axis=0) * 24 + np.arange(24)[:, np.newaxis]
+    fill = missing[:24] & days_valid.any(axis=0)
+    filled[:24][fill] = load[first_valid, np.arange(n_countries)][fill]
+    pending[:24] = pending[:24] & ~fill
+
+    # Fill the other gaps from the day before, 24 hours at a time
+    source = np.where(hours >= 24, hours - 24, hours)
+    while pending.any():
+        fill = pending & ~pending[source]
+        if not fill.any():
+            warn("The load time series of " + ", ".join(df_load.columns[pending.any(axis=0)].astype(str)) + " could not be filled.", UserWarning)
+            break
+        filled[fill] = (filled[source] * trend)[fill]
+        pending = pending & ~fill
+
+    return pd.DataFrame(filled, index=df_load.index, columns=df_load.columns)
 
 
 def clean_load_data_ENTSOE(paths, param):
     """
-    This function reads the raw load time series from ENTSO-E, filters them for the desired year, scales them based on their coverage
-    ratio, renames the countries based on *dict_countries*, and fills missing data by values from the day before (the magnitude is
-    adjusted based on the trend of the previous five hours).
+    This function reads the raw load time series from ENTSO-E, filters them for the years in *years* of the dictionary *load*, scales them based
+    on their coverage ratio, renames the countries based on *dict_countries*, and fills missing data by values from the day before (the magnitude
+    is adjusted based on the trend of the previous five hours, see :mod:`fill_load_gaps`). The raw file, which contains several years, is only
+    read once for all the years.
     
     :param paths: Dictionary containing the paths to the ENTSO-E input, to the dictionary of country names, and to the output.
     :type paths: dict
-    :param param: Dictionary containing information about the year of the data.
+    :param param: Dictionary containing information about the years of the data.
     :type param: dict
     
-    :return: The result is saved directly in a CSV file in the desired path, along with its corresponding metadata.
+    :return: The result is saved directly in a CSV file in the desired path for each year, along with its corresponding metadata.
     :rtype: None
     """
     timecheck("Start")
 
     # Read country load timeseries
-    df_raw = pd.read_excel(paths["load_ts"], header=0, skiprows=[0, 1, 2], sep=",", decimal=".")
-
-    # Filter by year
-    df_year = df_raw.loc[df_raw["Year"] == param["year"]]
-
-    # Scale based on coverage ratio
-    df_scaled = df_year.copy()
-    a = df_year.iloc[:, 5:].values
-    b = df_year.iloc[:, 4].values
-    c = a / b[:, np.newaxis] * 100
-    df_scaled.iloc[:, 5:] = c
-    del a, b, c
-
-    # Reshape so that rows correspond to hours and columns to countries
-    data = np.reshape(df_scaled.iloc[:, 5:].values.T, (-1, len(df_scaled["Country"].unique())), order="F")
-    # Create dataframe where rows correspond to hours and columns to countries
-    df_reshaped = pd.DataFrame(data, index=np.arange(data.shape[0]), columns=df_scaled["Country"].unique())
+    df_raw = read_source(paths, param, pd.read_excel, paths["load_ts"], header=0, skiprows=[0, 1, 2], sep=",", decimal=".")
 
     # Rename countries
     dict_countries = pd.read_csv(paths["dict_countries"], sep=";", decimal=",", index_col=["ENTSO-E"], usecols=["ENTSO-E", "Countries shapefile"])
@@ -304,22 +282,43 @@ def clean_load_data_ENTSOE(paths, param):
             for kk in keys:
                 dict_countries[kk] = v
             del dict_countries[k]
-    df_renamed = df_reshaped.rename(columns=dict_countries)
-
-    # Group countries with same name
-    df_grouped = df_renamed.T
-    df_grouped = df_grouped.reset_index().rename(columns={"index": "Country"})
-    df_grouped = df_grouped.groupby(["Country"]).sum().T
-    df_grouped.reset_index(inplace=True, drop=True)
-
-    # Fill missing data by values from the day before, adjusted based on the trend of the previous five hours
-    df_filled = df_grouped.copy()
-    for i, j in np.argwhere(df_filled.values == 0):
-        df_filled.iloc[i, j] = df_filled.iloc[i - 5 : i, j].sum() / df_filled.iloc[i - 5 - 24 : i - 24, j].sum() * df_filled.iloc[i - 24, j].sum()
 
-    df_filled.to_csv(paths["load_ts_clean"], index=False, sep=";", decimal=",")
-    print("File saved: " + paths["load_ts_clean"])
-    create_json(paths["load_ts_clean"], param, ["region_name", "year"], paths, ["dict_countries", "load_ts"])
+    for year in param["load"]["years"]:
+        paths_year = load_year_paths(paths.copy(), param, year)
+        param_year = param.copy()
+        param_year["year"] = year
+
+        # Filter by year
+        df_year = df_raw.loc[df_raw["Year"] == year]
+        if not len(df_year):
+            warn("No load data for the year " + str(year) + " in " + paths["load_ts"], UserWarning)
+            continue
+
+        # Scale based on coverage ratio
+        df_scaled = df_year.copy()
+        a = df_year.iloc[:, 5:].values
+        b = df_year.iloc[:, 4].values
+        c = a / b[:, np.newaxis] * 100
+        df_scaled.iloc[:, 5:] = c
+        del a, b, c
+
+        # Reshape so that rows correspond to hours and columns to countries
+        data = np.reshape(df_scaled.iloc[:, 5:].values.T, (-1, len(df_scaled["Country"].unique())), order="F")
+        # Create dataframe where rows correspond to hours and columns to countries
+        df_reshaped = pd.DataFrame(data, index=np.arange(data.shape[0]), columns=df_scaled["Country"].unique())
+        df_renamed = df_reshaped.rename(columns=dict_countries)
+
+        # Group countries with same name
+        df_grouped = df_renamed.T
+        df_grouped = df_grouped.reset_index().rename(columns={"index": "Country"})
+        df_grouped = df_grouped.groupby(["Country"]).sum().T
+        df_grouped.reset_index(inplace=True, drop=True)
+
+        # Fill missing data by values from the day before, adjusted based on the trend of the previous five hours
+        df_filled = fill_load_gaps(df_grouped)
+
+        save_intermediate(df_filled, paths_year["load_ts_clean"], param, index=False)
+        create_json(paths_year["load_ts_clean"], param_year, ["region_name", "year"], paths_year, ["dict_countries", "load_ts"])
 
     timecheck("End")
 
@@ -344,8 +343,15 @@ def clean_sector_shares_Eurostat(paths, param):
     dict_sectors = pd.read_csv(paths["dict_sectors"], sep=";", decimal=",", index_col=["EUROSTAT"], usecols=["EUROSTAT", "Model_sectors"])
     dict_sectors = dict_sectors.dropna()["Model_sectors"].to_dict()
 
-    df_raw = pd.read_csv(
-        paths["sector_shares"], sep=",", decimal=".", index_col=["TIME", "GEO", "INDIC_NRG"], usecols=["TIME", "GEO", "INDIC_NRG", "Value"]
+    df_raw = read_source(
+        paths,
+        param,
+        pd.read_csv,
+        paths["sector_shares"],
+        sep=",",
+        decimal=".",
+        index_col=["TIME", "GEO", "INDIC_NRG"],
+        usecols=["TIME", "GEO", "INDIC_NRG", "Value"],
     )
 
     # Filter the data
@@ -430,7 +436,9 @@ def clean_processes_and_storage_FRESNA(paths, param):
     dict_technologies = dict_technologies["Model names"].to_dict()
 
     # Get data from FRESNA database
-    Process = pd.read_csv(paths["FRESNA"], header=0, skipinitialspace=True, usecols=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13])
+    Process = read_source(
+        paths, param, pd.read_csv, paths["FRESNA"], header=0, skipinitialspace=True, usecols=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13]
+    )
     Process.rename(columns={"Capacity": "inst-cap", "lat": "Latitude", "lon": "Longitude"}, inplace=True)
 
     # Obtain preliminary information before cleaning
@@ -563,10 +571,84 @@ def clean_processes_and_storage_FRESNA(paths, param):
     timecheck("End")
 
 
+def parse_linestrings(wkt):
+    """
+    This function parses WKT line strings (optionally preceded by an SRID, e.g. ``SRID=4326;LINESTRING(lon lat,lon lat,...)``) for all the lines
+    at once. It keeps the true geometry with all its vertices, and returns the coordinates of the first and last vertices, as well as the
+    geodesic length of the line along all its vertices (see :mod:`lib.geodesic.geodesic_distance`).
+
+    :param wkt: Series of WKT line strings.
+    :type wkt: pandas series
+
+    :return (lines, vertices): Dataframe with the same index as *wkt* and the columns *V1_long*, *V1_lat*, *V2_long*, *V2_lat*, and *length_geo_m*,
+        and dataframe of the vertices of all the lines in their order, with the columns *long* and *lat* and the index of their line in *wkt*.
+        The rows that could not be parsed are missing in both.
+    :rtype: tuple(pandas dataframe, pandas dataframe)
+    """
+    inner = wkt.str.extract(r"LINESTRING\s*\(([^()]*)\)", expand=False)
+    if inner.isnull().any():
+        warn(str(inner.isnull().sum()) + " geometries are not line strings and have been skipped.", UserWarning)
+    inner = inner.dropna()
+    lines = pd.DataFrame(index=inner.index, columns=["V1_long", "V1_lat", "V2_long", "V2_lat", "length_geo_m"], dtype=float)
+    if not len(inner):
+        return lines, pd.DataFrame(columns=["long", "lat"], dtype=float)
+
+    # Coordinates of all the vertices of all the lines, and position of the last vertex of each line
+    points = inner.str.split(",")
+    n_vertices = points.str.len().values
+    coordinates = points.explode().str.split(expand=True).values[:, :2].astype(float)
+    last = np.cumsum(n_vertices) - 1
+    first = last - n_vertices + 1
+
+    # Length of each line along its segments (the segments between two lines are excluded)
+    segments = geodesic_distance(coordinates[:-1, 1], coordinates[:-1, 0], coordinates[1:, 1], coordinates[1:, 0])
+    line_of_segment = np.repeat(np.arange(len(inner)), n_vertices)[:-1]
+    within = np.ones(len(segments), dtype=bool)
+    within[last[:-1]] = False
+    length = np.bincount(line_of_segment[within], weights=segments[within], minlength=len(inner)) * 1000
+
+    lines["V1_long"], lines["V1_lat"] = coordinates[first, 0], coordinates[first, 1]
+    lines["V2_long"], lines["V2_lat"] = coordinates[last, 0], coordinates[last, 1]
+    lines["length_geo_m"] = length
+    vertices = pd.DataFrame(coordinates, index=np.repeat(inner.index.values, n_vertices), columns=["long", "lat"])
+    return lines, vertices
+
+
+def read_GridKit(filepath, chunksize=100000):
+    """
+    This function reads the raw CSV file of GridKit in blocks of *chunksize* rows, so that large extracts can be read with bounded memory.
+    Only the columns used in :mod:`clean_GridKit_Europe` are read. The WKT geometries of each block are parsed at once with :mod:`parse_linestrings`,
+    and replaced by the coordinates of the first and last vertices and the geodesic length. The vertices of all the lines are returned in a
+    separate table, with the line IDs as index, so that the geometries are not carried through the cleaning steps.
+
+    :param filepath: Path to the raw CSV file of GridKit.
+    :type filepath: string
+    :param chunksize: Number of rows read at once.
+    :type chunksize: integer
+
+    :return (grid_raw, grid_vertices): The lines of GridKit with their attributes, the coordinates of their first and last vertices and their geodesic length,
+        and the vertices of the lines with the columns *long* and *lat* and the line ID *l_id* as index.
+    :rtype: tuple(pandas dataframe, pandas dataframe)
+    """
+    columns = ["l_id", "voltage", "cables", "wires", "frequency", "length_m", "wkt_srid_4326"]
+    # Columns with multiple values are read as strings, so that their type does not depend on the values in each block
+    dtypes = {"voltage": str, "cables": str, "wires": str, "frequency": str}
+    chunks = []
+    vertices = []
+    for chunk in pd.read_csv(filepath, header=0, sep=",", decimal=".", usecols=columns, dtype=dtypes, chunksize=chunksize):
+        lines, chunk_vertices = parse_linestrings(chunk["wkt_srid_4326"])
+        chunk_vertices.index = chunk.loc[chunk_vertices.index, "l_id"].values
+        chunks.append(chunk.drop("wkt_srid_4326", axis=1).join(lines, how="inner"))
+        vertices.append(chunk_vertices)
+    grid_vertices = pd.concat(vertices)
+    grid_vertices.index.name = "l_id"
+    return pd.concat(chunks, ignore_index=True), grid_vertices
+
+
 def clean_GridKit_Europe(paths, param):
     """
-    This function reads the raw data from GridKit (Europe). First, it converts the column of locations into separate columns
-    of longitude and latitude of starting and ending points. Then, it expands the dataframe, so that every row would only have
+    This function reads the raw data from GridKit (Europe). First, it parses the geometries of the lines (see :mod:`read_GridKit`) into separate columns
+    of longitude and latitude of starting and ending points, and uses their geodesic length if *length_m* is missing. Then, it expands the dataframe, so that every row would only have
     one entry in the columns for *voltage*, *wires*, *cables*, and *frequency*. Based on the user judgement of the *quality* of
     the data, the dataframe is filtered and rows with missing data are filled with most common value.
     Based on *length_m* and *voltage*, the values for the impedance *X_ohm*, the *loadability* and the surge impedance loading
@@ -584,21 +666,13 @@ def clean_GridKit_Europe(paths, param):
 
     dict_line_voltage = pd.read_csv(paths["dict_line_voltage"], header=0, sep=";", decimal=",", index_col=["voltage_kV"])
 
-    # Read CSV file containing the lines data
-    grid_raw = pd.read_csv(paths["transmission_lines"], header=0, sep=",", decimal=".")
-
-    # Extract the string with the coordinates from the last column
-    grid_raw["wkt_srid_4326"] = pd.Series(map(lambda s: s[21:-1], grid_raw["wkt_srid_4326"]), grid_raw.index)
-
-    # Extract the coordinates into a new dataframe with four columns for each coordinate
-    coordinates = pd.DataFrame(grid_raw["wkt_srid_4326"].str.split(" |,").tolist(), columns=["V1_long", "V1_lat", "V2_long", "V2_lat"])
-
-    # Merge the original dataframe (grid_raw) with the one for the coordinates
-    grid_raw = grid_raw.merge(coordinates, how="outer", left_index=True, right_index=True)
+    # Read CSV file containing the lines data, and parse the geometries of the lines
+    grid_raw, grid_vertices = read_source(paths, param, read_GridKit, paths["transmission_lines"], chunksize=param["grid"]["chunk_rows"])
 
-    # Drop the old column and the coordinates dataframe
-    grid_raw.drop("wkt_srid_4326", axis=1, inplace=True)
-    del coordinates
+    # Use the length of the geometry if the length is missing
+    grid_raw["length_m"] = grid_raw["length_m"].astype(float)
+    missing_length = grid_raw["length_m"].isnull() | (grid_raw["length_m"] == 0)
+    grid_raw.loc[missing_length, "length_m"] = grid_raw.loc[missing_length, "length_geo_m"]
 
     # Expand columns with multiple values
     grid_expanded = grid_raw.copy()
@@ -662,7 +736,12 @@ def clean_GridKit_Europe(paths, param):
     )
     print("File saved: " + paths["grid_cleaned"])
 
-    # Writing to shapefile
+    # Writing to shapefile, with the vertices of each line in the order in which they were parsed
+    grid_vertices = grid_vertices.iloc[np.argsort(grid_vertices.index.values, kind="mergesort")]
+    vertex_ids = grid_vertices.index.values
+    vertex_coordinates = grid_vertices[["long", "lat"]].values
+    vertex_start = np.searchsorted(vertex_ids, grid_grouped["l_id"].values, side="left")
+    vertex_end = np.searchsorted(vertex_ids, grid_grouped["l_id"].values, side="right")
     with shp.Writer(paths["grid_shp"], shapeType=3) as w:
         w.autoBalance = 1
         w.field("ID", "N", 6, 0)
@@ -672,7 +751,7 @@ def clean_GridKit_Europe(paths, param):
         status = 0
         display_progress("Writing grid to shapefile: ", (count, status))
         for i in grid_grouped.index:
-            w.line([[grid_grouped.loc[i, ["V1_long", "V1_lat"]].astype(float), grid_grouped.loc[i, ["V2_long", "V2_lat"]].astype(float)]])
+            w.line([vertex_coordinates[vertex_start[i] : vertex_end[i]].tolist()])
             w.record(grid_grouped.loc[i, "l_id"], grid_grouped.loc[i, "Capacity_MVA"], grid_grouped.loc[i, "tr_type"])
             status += 1
             display_progress("Writing grid to shapefile: ", (count, status))
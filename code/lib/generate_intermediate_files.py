@@ -1,6 +1,8 @@
-from lib.correction_functions import get_sectoral_profiles, clean_names
+from lib.correction_functions import get_sectoral_profiles, clean_names, clean_load_profiles, clean_load_data_ENTSOE, clean_sector_shares_Eurostat
+from config import load_year_paths
 from lib.spatial_functions import *
 from lib.input_maps import *
+from lib.geodesic import geodesic_distance
 
 
 def generate_sites_from_shapefile(paths, param):
@@ -50,20 +52,20 @@ def generate_sites_from_shapefile(paths, param):
     # Read masks
     with rasterio.open(paths["LAND"]) as src:
         A_land = src.read(1)
-        A_land = np.flipud(A_land).astype(int)
+        A_land = np.flipud(A_land)
     with rasterio.open(paths["EEZ"]) as src:
         A_sea = src.read(1)
-        A_sea = np.flipud(A_sea).astype(int)
+        A_sea = np.flipud(A_sea)
 
     status = 0
     for reg in range(0, nRegions):
         # Display status bar
         display_progress("Generating sites ", (nRegions, status))
-        # Compute region_mask
-        A_region_extended = calc_region(regions_shp.loc[reg], Crd_all, res_desired, GeoRef)
+        # Compute region_mask within the bounding box of the region
+        A_region, window = calc_region_window(regions_shp.loc[reg], Crd_all, res_desired, GeoRef)
 
         # Get name of region
-        if np.nansum(A_region_extended * A_land) > np.nansum(A_region_extended * A_sea):
+        if np.nansum(A_region * A_land[window]) > np.nansum(A_region * A_sea[window]):
             regions.loc[reg, "Name"] = regions_shp.loc[reg]["NAME_SHORT"]
         else:
             regions.loc[reg, "Name"] = regions_shp.loc[reg]["NAME_SHORT"] + "_offshore"
@@ -137,7 +139,7 @@ def generate_intermittent_supply_timeseries(paths, param):
         for mode in param["ren_potential"][tech]:
             # Check 1: TS file exist
             if os.path.isfile(paths["TS_ren"][tech]):
-                TS = pd.read_csv(paths["TS_ren"][tech], sep=";", decimal=",", index_col=[0])
+                TS = pd.read_csv(paths["TS_ren"][tech], sep=";", decimal=",", index_col=[0]).astype(param["intermediate"]["ts_dtype"])
             else:
                 warn("No time series found for " + tech + " under path: " + paths["TS_ren"][tech], UserWarning)
                 continue
@@ -195,8 +197,8 @@ def generate_intermittent_supply_timeseries(paths, param):
             else:
                 Timeseries = pd.concat([Timeseries, TS_tech], axis=1)
 
-    Timeseries.to_csv(paths["potential_ren"], sep=";", decimal=",")
-    print("File Saved: " + paths["potential_ren"])
+    Timeseries = Timeseries.astype(param["intermediate"]["ts_dtype"])
+    save_intermediate(Timeseries, paths["potential_ren"], param)
     create_json(paths["potential_ren"], param, ["region_name", "subregions_name", "technology", "ren_potential"], paths, ["TS_ren"])
     timecheck("End")
 
@@ -207,6 +209,10 @@ def generate_load_timeseries(paths, param):
     On one hand, it splits the time series into sectoral time series for each country. On the other hand, it determines the time series for each pixel of land use
     and for each person in the country, by assuming a relationship between sectors and land use types / population size. Finally, it aggregates the time series of the
     pixels that lie in the same subregions to obtain the time series for each desired subregion.
+
+    The load is generated for all the years in *years* of the dictionary *load*. The spatial statistics of the countries and of the country parts
+    are only computed once, the sectoral split of all the years is calculated at once (see :mod:`split_load_into_sectors`), and the outputs are saved
+    for each year in the paths of :mod:`config.load_year_paths`.
     
     :param paths: Dictionary containing the paths to the cleaned input, to the intermediate files and to the outputs.
     :type paths: dict
@@ -236,9 +242,6 @@ def generate_load_timeseries(paths, param):
     sector_lu = sector_lu.transpose().div(np.repeat(sector_lu.sum(axis=0)[:, None], len(sector_lu), axis=1))
     sec = [str(i) for i in sector_lu.index]
 
-    # Share of sectors in electricity demand
-    sec_share = pd.read_csv(paths["sector_shares_clean"], index_col=0, sep=";", decimal=",")
-
     # Create landuse and population maps, if they do not exist already
     if not os.path.exists(paths["LU"]):
         generate_landuse(paths, param)
@@ -258,83 +261,82 @@ def generate_load_timeseries(paths, param):
     for s in sec:
         stat.loc[:, s] = np.dot(stat.loc[:, landuse_types], sector_lu.loc[s])
 
-    if not (os.path.isfile(paths["df_sector"]) and os.path.isfile(paths["load_sector"]) and os.path.isfile(paths["load_landuse"])):
-
-        # Get dataframe with cleaned timeseries for countries
-        df_load_countries = pd.read_csv(paths["load_ts_clean"], sep=";", decimal=",")
-        countries = param["regions_land"].rename(columns={"GID_0": "Country"})
-
-        # Get sectoral normalized profiles
-        profiles = get_sectoral_profiles(paths, param)
-
-        # Prepare an empty table of the hourly load for the five sectors in each countries.
-        df_sectors = pd.DataFrame(
-            0,
-            index=df_load_countries.index,
-            columns=pd.MultiIndex.from_product([df_load_countries.columns.tolist(), list_sectors], names=["Country", "Sector"]),
-        )
-
-        # Copy the load profiles for each sector in the columns of each country, and multiply each sector by the share
-        # defined in 'sec_share'. Note that at the moment the values are the same for all countries
-        for c in df_load_countries.columns:
-            for s in list_sectors:
-                try:
-                    df_sectors.loc[:, (c, s)] = profiles[s] * sec_share.loc[c, s]
-                except KeyError:
-                    df_sectors.loc[:, (c, s)] = profiles[s] * sec_share.loc[param["load"]["default_sec_shares"], s]
-
-        # Normalize the load profiles over all sectors by the hour so that the sum of the loads of all sectors = 1
-        # for each hour, then multiply with the actual hourly loads for each country
-        df_scaling = df_sectors.groupby(level=0, axis=1).sum()
-        for c in df_load_countries.columns:
-            for s in sec + ["RES"]:
-                df_sectors.loc[:, (c, s)] = df_sectors.loc[:, (c, s)] / df_scaling[c] * df_load_countries[c]
-
-        # Calculate the yearly load per sector and country
-        load_sector = df_sectors.sum(axis=0).rename("Load in MWh")
-
-        # Prepare dataframe load_landuse, which calculates the hourly load for each land use unit in each country
-        rows = landuse_types.copy()
-        rows.append("RES")
-        countries = sorted(list(set(stat.index.tolist()).intersection(set(df_load_countries.columns))))
-        m_index = pd.MultiIndex.from_product([countries, rows], names=["Country", "Land use"])
-        load_landuse = pd.DataFrame(0, index=m_index, columns=df_sectors.index)
-
-        status = 0
-        length = len(countries) * len(landuse_types) * len(sec)
-        display_progress("Computing regions load", (length, status))
-        for c in countries:  # Countries
-            load_landuse.loc[c, "RES"] = load_landuse.loc[c, "RES"] + df_sectors[(c, "RES")] / stat.loc[c, "RES"]
-            for lu in landuse_types:  # Land use types
-                for s in sec:  # other sectors
-                    load_landuse.loc[c, lu] = load_landuse.loc[c, lu] + sector_lu.loc[s, int(lu)] * df_sectors[(c, s)] / stat.loc[c, s]
-                    status = status + 1
-                    display_progress("Computing regions load", (length, status))
-
-        # Save the data into HDF5 files for faster execution
-        df_sectors.to_csv(paths["df_sector"], sep=";", decimal=",", index=False, header=True)
-        print("Dataframe with time series for each country and sector saved: " + paths["df_sector"])
-        create_json(paths["df_sector"], param, ["region_name", "year", "load"], paths, ["spatial_scope", "dict_sectors", "load_ts_clean"])
-        load_sector.to_csv(paths["load_sector"], sep=";", decimal=",", index=True, header=True)
-        print("Dataframe with yearly demand for each country and sector saved: " + paths["load_sector"])
-        create_json(paths["load_sector"], param, ["region_name", "year", "load"], paths, ["spatial_scope", "dict_sectors", "load_ts_clean"])
-        load_landuse.to_csv(paths["load_landuse"], sep=";", decimal=",", index=True)
-        print("Dataframe with time series for each land use pixel saved: " + paths["load_landuse"])
-        create_json(
-            paths["load_landuse"], param, ["region_name", "year", "load", "landuse_types"], paths, ["spatial_scope", "dict_sectors", "load_ts_clean"]
+    # Paths and parameters of each year
+    years = param["load"]["years"]
+    paths_years = {}
+    param_years = {}
+    for year in years:
+        paths_years[year] = load_year_paths(paths.copy(), param, year)
+        param_years[year] = param.copy()
+        param_years[year]["year"] = year
+
+    missing_years = [
+        year
+        for year in years
+        if not (
+            intermediate_exists(paths_years[year]["df_sector"], param)
+            and intermediate_exists(paths_years[year]["load_sector"], param)
+            and intermediate_exists(paths_years[year]["load_landuse"], param)
         )
-
-    # Read CSV files
-    df_sectors = pd.read_csv(paths["df_sector"], sep=";", decimal=",", header=[0, 1])
-    load_sector = pd.read_csv(paths["load_sector"], sep=";", decimal=",", index_col=[0, 1])["Load in MWh"]
-    load_landuse = pd.read_csv(paths["load_landuse"], sep=";", decimal=",", index_col=[0, 1])
-
-    # Split subregions into country parts
-    # (a subregion can overlap with many countries, but a country part belongs to only one country)
-    reg_intersection = intersection_subregions_countries(paths, param)
+    ]
+    if len(missing_years):
+        dtype = param["intermediate"]["ts_dtype"]
+
+        # Split the load of the countries into sectors, for all the years at once
+        df_sectors_years = split_load_into_sectors(paths_years, param_years, missing_years, list_sectors, sec)
+
+        for year in missing_years:
+            df_sectors = df_sectors_years[year]
+
+            # Calculate the yearly load per sector and country (always in double precision)
+            load_sector = pd.Series(df_sectors.values.sum(axis=0, dtype=np.float64), index=df_sectors.columns, name="Load in MWh")
+
+            # Prepare dataframe load_landuse, which calculates the hourly load for each land use unit in each country
+            rows = landuse_types.copy()
+            rows.append("RES")
+            countries = sorted(list(set(stat.index.tolist()).intersection(set(df_sectors.columns.get_level_values(0)))))
+            m_index = pd.MultiIndex.from_product([countries, rows], names=["Country", "Land use"])
+
+            # Hourly load of each sector and its weighting factor in each country, as arrays of shape (countries, sectors, hours) and (countries, sectors)
+            load_countries = np.stack([df_sectors.loc[:, [(c, s) for s in sec + ["RES"]]].values.T for c in countries])
+            weights = stat.loc[countries, sec + ["RES"]].values.astype(dtype)
+            coef = sector_lu.loc[sec, [int(lu) for lu in landuse_types]].values.astype(dtype)
+
+            # Add up the sectors one after the other, for all countries, land use types and hours at once
+            load_lu = np.zeros((len(countries), len(rows), len(df_sectors.index)), dtype=dtype)
+            for i in range(0, len(sec)):
+                load_lu[:, :-1, :] = (
+                    load_lu[:, :-1, :]
+                    + coef[i][np.newaxis, :, np.newaxis] * load_countries[:, i, np.newaxis, :] / weights[:, i, np.newaxis, np.newaxis]
+                )
+            load_lu[:, -1, :] = load_countries[:, -1, :] / weights[:, -1, np.newaxis]
+            load_landuse = pd.DataFrame(load_lu.reshape((-1, len(df_sectors.index))), index=m_index, columns=df_sectors.index)
+
+            # Save the data into HDF5 files for faster execution
+            paths_year = paths_years[year]
+            param_year = param_years[year]
+            save_intermediate(df_sectors, paths_year["df_sector"], param, index=False)
+            create_json(
+                paths_year["df_sector"], param_year, ["region_name", "year", "load"], paths_year, ["spatial_scope", "dict_sectors", "load_ts_clean"]
+            )
+            save_intermediate(load_sector.to_frame(), paths_year["load_sector"], param)
+            create_json(
+                paths_year["load_sector"], param_year, ["region_name", "year", "load"], paths_year, ["spatial_scope", "dict_sectors", "load_ts_clean"]
+            )
+            save_intermediate(load_landuse, paths_year["load_landuse"], param)
+            create_json(
+                paths_year["load_landuse"],
+                param_year,
+                ["region_name", "year", "load", "landuse_types"],
+                paths_year,
+                ["spatial_scope", "dict_sectors", "load_ts_clean"],
+            )
 
     # Count number of pixels for each country part
     if not os.path.exists(paths["stats_country_parts"]):
+        # Split subregions into country parts
+        # (a subregion can overlap with many countries, but a country part belongs to only one country)
+        reg_intersection = intersection_subregions_countries(paths, param)
         df = zonal_stats(reg_intersection, {"Population": paths["POP"], "Landuse": paths["LU"]}, param)
         stat_sub = reg_intersection[["NAME_SHORT"]].rename(columns={"NAME_SHORT": "Country_part"}).join(df).set_index("Country_part")
         stat_sub.to_csv(paths["stats_country_parts"], sep=";", decimal=",", index=True)
@@ -349,52 +351,137 @@ def generate_load_timeseries(paths, param):
         stat_sub = pd.read_csv(paths["stats_country_parts"], sep=";", decimal=",", index_col=0)
 
     # Add attributes for country/region
-    stat_sub["Region"] = 0
-    stat_sub["Country"] = 0
-    for i in stat_sub.index:
-        stat_sub.loc[i, ["Region", "Country"]] = i.split("_")
-        if stat_sub.loc[i, "Country"] not in list(df_sectors.columns.get_level_values(0).unique()):
-            stat_sub.drop(index=i, inplace=True)
-
-    # Prepare dataframe to save the hourly load in each country part
-    load_country_part = pd.DataFrame(0, index=stat_sub.index, columns=df_sectors.index.tolist() + ["Region", "Country"])
-    load_country_part[["Region", "Country"]] = stat_sub[["Region", "Country"]]
-
-    # Calculate the hourly load for each subregion
-    status = 0
-    length = len(load_country_part.index) * len(landuse_types)
-    display_progress("Computing sub regions load:", (length, status))
-    for cp in load_country_part.index:
-        c = load_country_part.loc[cp, "Country"]
-        # For residential:
-        load_country_part.loc[cp, df_sectors.index.tolist()] = (
-            load_country_part.loc[cp, df_sectors.index.tolist()] + stat_sub.loc[cp, "RES"] * load_landuse.loc[c, "RES"].to_numpy()
+    stat_sub["Region"] = [i.rsplit("_", 1)[0] for i in stat_sub.index]
+    stat_sub["Country"] = [i.rsplit("_", 1)[1] for i in stat_sub.index]
+    rows = ["RES"] + landuse_types
+
+    for year in years:
+        paths_year = paths_years[year]
+        param_year = param_years[year]
+
+        # Only keep the country parts of countries with a load time series
+        load_landuse = read_intermediate(paths_year["load_landuse"], param, index_col=[0, 1])
+        countries = list(load_landuse.index.get_level_values(0).unique())
+        stat_year = stat_sub.loc[stat_sub["Country"].isin(countries)]
+        regions = sorted(stat_year["Region"].unique())
+
+        # Sparse matrix of weights: each country part adds its number of persons (RES) and of pixels of each land use type
+        # to the row of its region, in the columns of its country
+        region_id = dict(zip(regions, range(0, len(regions))))
+        country_id = dict(zip(countries, range(0, len(countries))))
+        weights = sparse.coo_matrix(
+            (
+                stat_year[rows].values.ravel(),
+                (
+                    np.repeat([region_id[r] for r in stat_year["Region"]], len(rows)),
+                    (np.array([country_id[c] for c in stat_year["Country"]])[:, np.newaxis] * len(rows) + np.arange(len(rows))).ravel(),
+                ),
+            ),
+            shape=(len(regions), len(countries) * len(rows)),
+        ).tocsr()
+
+        # Output: the factors of the load time series, and the time series themselves if required
+        save_load_factors(paths_year["load_regions_factors"], weights, regions, countries, rows)
+        create_json(
+            paths_year["load_regions_factors"],
+            param_year,
+            ["region_name", "subregions_name", "load", "landuse_types"],
+            paths_year,
+            ["spatial_scope", "LU", "POP", "Countries", "subregions", "load_landuse"],
         )
-        for lu in landuse_types:
-            load_country_part.loc[cp, df_sectors.index.tolist()] = (
-                load_country_part.loc[cp, df_sectors.index.tolist()] + stat_sub.loc[cp, lu] * load_landuse.loc[c, lu].to_numpy()
+        if param["load"]["subregions_dense"]:
+            load_regions = read_load_regions(paths_year, param)
+            save_intermediate(load_regions, paths_year["load_regions"], param)
+            create_json(
+                paths_year["load_regions"],
+                param_year,
+                ["region_name", "subregions_name", "load", "landuse_types"],
+                paths_year,
+                ["spatial_scope", "LU", "POP", "Countries", "subregions"],
             )
-            # Show progress
-            status = status + 1
-            display_progress("Computing load in country parts", (length, status))
 
-    # Aggregate into subregions
-    load_regions = load_country_part.groupby(["Region", "Country"]).sum()
-    load_regions.reset_index(inplace=True)
-    load_regions = load_regions.groupby(["Region"]).sum().T
+    timecheck("End")
 
-    # Output
-    load_regions.to_csv(paths["load_regions"], sep=";", decimal=",", index=True)
-    create_json(
-        paths["load_regions"],
-        param,
-        ["region_name", "subregions_name", "load", "landuse_types"],
-        paths,
-        ["spatial_scope", "LU", "POP", "Countries", "subregions"],
-    )
-    print("File saved: " + paths["load_regions"])
 
-    timecheck("End")
+def split_load_into_sectors(paths_years, param_years, years, list_sectors, sec):
+    """
+    This function splits the cleaned load time series of the countries into sectoral time series, for several years at once. The standard load
+    profile of each sector is multiplied by the share of the sector in each country (or by the default shares *default_sec_shares* if the country
+    is missing), then the profiles are normalized by the hour over all sectors and multiplied with the hourly load of each country.
+    The years with the same countries and the same number of hours are stacked and processed in one array operation. The load profiles of each
+    year are taken from the profile registry (see :mod:`lib.util.get_sectoral_profiles`). If the cleaned load profiles, load or sector shares of a
+    year are missing, they are generated first.
+
+    :param paths_years: Dictionary with the years as keys and the paths of each year as values (see :mod:`config.load_year_paths`).
+    :type paths_years: dict
+    :param param_years: Dictionary with the years as keys and the parameters of each year as values.
+    :type param_years: dict
+    :param years: Years to be processed.
+    :type years: list
+    :param list_sectors: Names of all the sectors.
+    :type list_sectors: list
+    :param sec: Names of the sectors that are allocated to land use types.
+    :type sec: list
+
+    :return df_sectors_years: Dictionary with the years as keys and the dataframes of the hourly load of each sector in each country as values.
+    :rtype: dict
+    """
+    param = param_years[years[0]]
+    dtype = param["intermediate"]["ts_dtype"]
+
+    # Read the sectoral normalized profiles, the cleaned load and the sector shares of each year, and group the years that can be stacked
+    profiles = {}
+    df_load_countries = {}
+    sec_share = {}
+    groups = {}
+
+    # Clean the load of all the missing years at once
+    missing_years = [year for year in years if not intermediate_exists(paths_years[year]["load_ts_clean"], param)]
+    if len(missing_years):
+        param_load = param.copy()
+        param_load["load"] = dict(param["load"], years=missing_years)
+        clean_load_data_ENTSOE(paths_years[years[0]], param_load)
+
+    for year in years:
+        clean_load_profiles(paths_years[year], param_years[year])
+        profiles_year = get_sectoral_profiles(paths_years[year], param_years[year])
+        profiles[year] = np.stack([profiles_year[s].values for s in list_sectors], axis=-1)
+        if not os.path.isfile(paths_years[year]["sector_shares_clean"]):
+            clean_sector_shares_Eurostat(paths_years[year], param_years[year])
+        df_load_countries[year] = read_intermediate(paths_years[year]["load_ts_clean"], param)
+        sec_share[year] = pd.read_csv(paths_years[year]["sector_shares_clean"], index_col=0, sep=";", decimal=",")
+        key = (tuple(df_load_countries[year].columns), len(df_load_countries[year]))
+        groups[key] = groups.get(key, []) + [year]
+
+    df_sectors_years = {}
+    for (countries, n_hours), group in groups.items():
+        countries = list(countries)
+
+        # Shares of the sectors in each country, with the default shares for the missing countries: shape (years, countries, sectors)
+        shares = []
+        for year in group:
+            default = sec_share[year].loc[param["load"]["default_sec_shares"], list_sectors]
+            share = sec_share[year].reindex(index=countries, columns=list_sectors)
+            share.loc[~share.index.isin(sec_share[year].index), :] = default.values
+            shares.append(share.values)
+        shares = np.stack(shares).astype(dtype)
+
+        # Copy the load profiles for each sector in the columns of each country, and multiply each sector by its share: shape (years, hours, countries, sectors)
+        profiles_group = np.stack([profiles[year][:n_hours] for year in group]).astype(dtype)
+        load = profiles_group[:, :, np.newaxis, :] * shares[:, np.newaxis, :, :]
+
+        # Normalize the load profiles over all sectors by the hour so that the sum of the loads of all sectors = 1
+        # for each hour, then multiply with the actual hourly loads for each country
+        scaling = load.sum(axis=3)
+        load_countries = np.stack([df_load_countries[year].values for year in group]).astype(dtype)
+        normalized = [list_sectors.index(s) for s in sec + ["RES"]]
+        load[:, :, :, normalized] = load[:, :, :, normalized] / scaling[:, :, :, np.newaxis] * load_countries[:, :, :, np.newaxis]
+
+        columns = pd.MultiIndex.from_product([countries, list_sectors], names=["Country", "Sector"])
+        for i in range(0, len(group)):
+            df_sectors_years[group[i]] = pd.DataFrame(load[i].reshape((n_hours, -1)), index=df_load_countries[group[i]].index, columns=columns)
+
+    return df_sectors_years
 
 
 def generate_transmission(paths, param):
@@ -404,7 +491,7 @@ def generate_transmission(paths, param):
     the length between the centroids of the regions and uses it to estimate the efficiency of the lines and their costs. Finally,
     it completes the missing attributes with general assumptions and saves the result in a CSV file.
     
-    :param paths: Dictionary including the paths to *assumptions_transmission*, *grid_cleaned*, *sites_sub*, *subregions*, *dict_line_voltage*, and the output *grid_completed*.
+    :param paths: Dictionary including the paths to *assumptions_transmission*, *grid_cleaned*, *sites_sub*, *dict_line_voltage*, the folder *grid_sub*, and the output *grid_completed*.
     :type param: dict
     :param param: Dictionary including the geodataframe of the subregions and grid-related assumptions.
     :type param: dict
@@ -421,30 +508,16 @@ def generate_transmission(paths, param):
     assumptions_tra = assumptions_tra.loc[assumptions_tra["year"] == param["model_year"]]
     assumptions_tra.drop(columns=["year"], inplace=True)
 
-    # Read the geodataframe of subregions
-    subregions = param["regions_sub"][["NAME_SHORT", "geometry"]]
-
     # Read the cleaned GridKit dataset
     grid_cleaned = pd.read_csv(paths["grid_cleaned"], header=0, sep=";", decimal=",")
 
-    # Create point geometries
-    grid_cleaned["V1"] = list(zip(grid_cleaned.V1_long, grid_cleaned.V1_lat))
-    grid_cleaned["V1"] = grid_cleaned["V1"].apply(Point)
-    grid_cleaned["V2"] = list(zip(grid_cleaned.V2_long, grid_cleaned.V2_lat))
-    grid_cleaned["V2"] = grid_cleaned["V2"].apply(Point)
-
-    # Create a dataframe for the start regions
-    Region_start = gpd.GeoDataFrame(grid_cleaned[["l_id", "V1"]], geometry="V1", crs={"init": "epsg:4326"}).rename(columns={"V1": "geometry"})
-    Region_start.crs = subregions.crs
-    Region_start = gpd.sjoin(Region_start, subregions, how="left", op="intersects")[["NAME_SHORT"]].rename(columns={"NAME_SHORT": "Region_start"})
-
-    # Create a dataframe for the end regions
-    Region_end = gpd.GeoDataFrame(grid_cleaned[["l_id", "V2"]], geometry="V2", crs={"init": "epsg:4326"}).rename(columns={"V2": "geometry"})
-    Region_end.crs = subregions.crs
-    Region_end = gpd.sjoin(Region_end, subregions, how="left", op="intersects")[["NAME_SHORT"]].rename(columns={"NAME_SHORT": "Region_end"})
-
-    # Join dataframes
-    grid_regions = grid_cleaned.drop(["V1", "V2"], axis=1).join([Region_start, Region_end])
+    # Locate the start and end points of all the lines at once
+    lon = np.concatenate((grid_cleaned["V1_long"].values, grid_cleaned["V2_long"].values))
+    lat = np.concatenate((grid_cleaned["V1_lat"].values, grid_cleaned["V2_lat"].values))
+    regions = locate_points(lon, lat, param["regions_sub"], param["locator"]["tolerance"])
+    grid_regions = grid_cleaned.copy()
+    grid_regions["Region_start"] = regions[: len(grid_cleaned)]
+    grid_regions["Region_end"] = regions[len(grid_cleaned) :]
 
     intra = len(grid_regions.loc[(grid_regions["Region_start"] == grid_regions["Region_end"]) & ~(grid_regions["Region_start"].isnull())])
     extra = len(grid_regions.loc[grid_regions["Region_start"].isnull() | grid_regions["Region_end"].isnull()])
@@ -473,13 +546,8 @@ def generate_transmission(paths, param):
     lines_final["impedance"] = 1 / lines_final["Y_mho_ref_380kV"]
 
     # Create a dataframe to store all the possible combinations of pairs of 1st order neighbors
-    df = pd.DataFrame(columns=["Site In", "Site Out"])
     zones = pd.read_csv(paths["sites_sub"], index_col=0, decimal=",", sep=";")
-    weights = ps.lib.weights.Queen.from_shapefile(paths["subregions"])
-    for z in range(len(zones)):
-        for n in weights.neighbors[z]:
-            if zones.iloc[z].name < zones.iloc[n].name:
-                df = df.append(pd.DataFrame([[zones.iloc[z].name, zones.iloc[n].name]], columns=["Site In", "Site Out"]), ignore_index=True)
+    df = region_neighbors(paths, param)
 
     # Join that dataframe with existing lines
     df["tr_type"] = "AC_OHL"
@@ -491,14 +559,14 @@ def generate_transmission(paths, param):
 
     # Calculate length of lines based on distance between centroids
     df_joined.reset_index(drop=False, inplace=True)
+    unknown = ~(df_joined["Site In"].isin(zones.index) & df_joined["Site Out"].isin(zones.index))
+    if unknown.any():
+        dropped = ", ".join((df_joined.loc[unknown, "Site In"] + "-" + df_joined.loc[unknown, "Site Out"]).tolist())
+        warn(str(unknown.sum()) + " pairs of regions are not found in " + paths["sites_sub"] + " and are dropped: " + dropped, UserWarning)
     df_joined = df_joined.join(zones[["Longitude", "Latitude"]], on="Site In", rsuffix="_1", how="inner")
     df_joined = df_joined.join(zones[["Longitude", "Latitude"]], on="Site Out", rsuffix="_2", how="inner")
-    df_joined["length"] = [
-        distance.distance(
-            tuple(df_joined.loc[i, ["Latitude", "Longitude"]].astype(float)), tuple(df_joined.loc[i, ["Latitude_2", "Longitude_2"]].astype(float))
-        ).km
-        for i in df_joined.index
-    ]
+    coordinates = df_joined[["Latitude", "Longitude", "Latitude_2", "Longitude_2"]].astype(float).values
+    df_joined["length"] = geodesic_distance(coordinates[:, 0], coordinates[:, 1], coordinates[:, 2], coordinates[:, 3])
     df_joined.drop(["Longitude", "Latitude", "Longitude_2", "Latitude_2"], axis=1, inplace=True)
 
     # Use tuple of (Type, length_limit_km) as key for dictionary of assumptions
@@ -591,11 +659,11 @@ def generate_commodities(paths, param):
         .set_index(["Site"])
     )
 
-    # Read the CSV containing the load time series
-    load = pd.read_csv(paths["load_regions"], sep=";", decimal=",", index_col=0)
+    # Read the yearly load of the subregions
+    annual = read_load_regions_annual(paths, param)
 
     # Correct the annual load
-    df_com.loc[df_com["Commodity"] == "Elec", "annual"] = load.sum(axis=0)
+    df_com.loc[df_com["Commodity"] == "Elec", "annual"] = annual
 
     df_com.to_csv(paths["commodities_regions"], index=True, sep=";", decimal=",")
     print("File saved: " + paths["commodities_regions"])
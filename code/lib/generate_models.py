@@ -156,8 +156,8 @@ def generate_urbs_model(paths, param):
     # Read DSM
 
     # Read electricity demand
-    if os.path.exists(paths["load_regions"]):
-        demand = pd.read_csv(paths["load_regions"], sep=";", decimal=",", index_col=0)
+    demand = read_load_regions(paths, param)
+    if demand is not None:
         demand.columns = demand.columns + ".Elec"
         demand.index = range(1, 8761)
         demand.loc[0] = 0
@@ -167,8 +167,8 @@ def generate_urbs_model(paths, param):
         del demand
 
     # Read intermittent supply time series
-    if os.path.exists(paths["potential_ren"]):
-        supim = pd.read_csv(paths["potential_ren"], sep=";", decimal=",", index_col=0)
+    if intermediate_exists(paths["potential_ren"], param):
+        supim = read_intermediate(paths["potential_ren"], param, index_col=0)
         supim.index = range(1, 8761)
         supim.insert(0, "t", supim.index)
         urbs_model["SupIm"] = supim.astype("f")
@@ -346,9 +346,9 @@ def generate_evrys_model(paths, param):
     # Read DSM
 
     # Read intermittent supply time series
-    if os.path.exists(paths["potential_ren"]):
+    if intermediate_exists(paths["potential_ren"], param):
         # Format to evrys input format
-        raw_data = pd.read_csv(paths["potential_ren"], sep=";", decimal=",", index_col=0)
+        raw_data = read_intermediate(paths["potential_ren"], param, index_col=0)
         sites = []
         com = []
         for col in list(raw_data.columns):
@@ -0,0 +1,145 @@
+from lib.util import *
+
+# Mean radius of the Earth in km, and parameters of the WGS84 ellipsoid
+earth_radius = 6371.0088
+wgs84_a = 6378.137
+wgs84_f = 1 / 298.257223563
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    This function calculates the great-circle distance between points on a sphere with the mean radius of the Earth, using the haversine
+    formula. The inputs can be arrays of any shape that can be broadcast together. The error compared with the distance on the WGS84
+    ellipsoid is below 0.5%.
+
+    :param lat1: Latitudes of the first points in degrees.
+    :type lat1: numpy array
+    :param lon1: Longitudes of the first points in degrees.
+    :type lon1: numpy array
+    :param lat2: Latitudes of the second points in degrees.
+    :type lat2: numpy array
+    :param lon2: Longitudes of the second points in degrees.
+    :type lon2: numpy array
+
+    :return dist: Distances in km.
+    :rtype: numpy array
+    """
+    phi1, lam1, phi2, lam2 = [np.radians(np.asarray(x, dtype=float)) for x in [lat1, lon1, lat2, lon2]]
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lam2 - lam1) / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, tol=1e-12, max_iter=200):
+    """
+    This function calculates the distance between points on the WGS84 ellipsoid with the inverse formula of Vincenty, for all the points at once.
+    The inputs can be arrays of any shape that can be broadcast together. Where the iteration converges, the result agrees with the geodesic
+    distance of Karney (used by ``geopy``) within a millimeter. For nearly antipodal points, where it does not converge after *max_iter*
+    iterations, the great-circle distance of :mod:`haversine` is used instead and a warning is shown.
+
+    :param lat1: Latitudes of the first points in degrees.
+    :type lat1: numpy array
+    :param lon1: Longitudes of the first points in degrees.
+    :type lon1: numpy array
+    :param lat2: Latitudes of the second points in degrees.
+    :type lat2: numpy array
+    :param lon2: Longitudes of the second points in degrees.
+    :type lon2: numpy array
+    :param tol: Convergence threshold for the longitude on the auxiliary sphere, in radians.
+    :type tol: float
+    :param max_iter: Maximum number of iterations.
+    :type max_iter: integer
+
+    :return dist: Distances in km.
+    :rtype: numpy array
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in [lat1, lon1, lat2, lon2]])
+    b = wgs84_a * (1 - wgs84_f)
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - wgs84_f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - wgs84_f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    pending = np.ones(L.shape, dtype=bool)
+    for iteration in range(0, max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sin_alpha = np.where(sin_sigma == 0, 0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # On the equator, cos2_alpha is 0 and the term is not used
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+        C = wgs84_f / 16 * cos2_alpha * (4 + wgs84_f * (4 - 3 * cos2_alpha))
+        lam_new = L + (1 - C) * wgs84_f * sin_alpha * (sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        pending = np.abs(lam_new - lam) > tol
+        lam = np.where(pending, lam_new, lam)
+        if not pending.any():
+            break
+
+    u2 = cos2_alpha * (wgs84_a ** 2 - b ** 2) / b ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    term = cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * term)
+    dist = b * A * (sigma - delta_sigma)
+
+    if pending.any():
+        warn(str(pending.sum()) + " distances did not converge and have been replaced with great-circle distances.", UserWarning)
+        dist = np.where(pending, haversine(lat1, lon1, lat2, lon2), dist)
+    return dist
+
+
+def geodesic_distance(lat1, lon1, lat2, lon2, method="ellipsoid"):
+    """
+    This function calculates the distance between two sets of points, element-wise:
+
+      * ``'ellipsoid'``: distance on the WGS84 ellipsoid (see :mod:`vincenty`), which is equivalent to ``geopy.distance.distance``.
+      * ``'sphere'``: great-circle distance (see :mod:`haversine`), which is faster but less precise.
+
+    :param lat1: Latitudes of the first points in degrees.
+    :type lat1: numpy array
+    :param lon1: Longitudes of the first points in degrees.
+    :type lon1: numpy array
+    :param lat2: Latitudes of the second points in degrees.
+    :type lat2: numpy array
+    :param lon2: Longitudes of the second points in degrees.
+    :type lon2: numpy array
+    :param method: Either ``'ellipsoid'`` or ``'sphere'``.
+    :type method: string
+
+    :return dist: Distances in km.
+    :rtype: numpy array
+    """
+    if method == "ellipsoid":
+        return vincenty(lat1, lon1, lat2, lon2)
+    if method == "sphere":
+        return haversine(lat1, lon1, lat2, lon2)
+    raise Exception("Unknown distance method: " + str(method))
+
+
+def pairwise_distances(lat1, lon1, lat2=None, lon2=None, method="ellipsoid"):
+    """
+    This function calculates the matrix of distances between all the points of a first set (rows) and all the points of a second set (columns).
+    If the second set is not given, the distances between all the points of the first set are calculated.
+
+    :param lat1: Latitudes of the first set of points in degrees.
+    :type lat1: numpy array
+    :param lon1: Longitudes of the first set of points in degrees.
+    :type lon1: numpy array
+    :param lat2: Latitudes of the second set of points in degrees.
+    :type lat2: numpy array
+    :param lon2: Longitudes of the second set of points in degrees.
+    :type lon2: numpy array
+    :param method: Either ``'ellipsoid'`` or ``'sphere'`` (see :mod:`geodesic_distance`).
+    :type method: string
+
+    :return dist: Matrix of distances in km, of shape (number of points of the first set, number of points of the second set).
+    :rtype: numpy array
+    """
+    lat1, lon1 = np.asarray(lat1, dtype=float).ravel(), np.asarray(lon1, dtype=float).ravel()
+    if lat2 is None:
+        lat2, lon2 = lat1, lon1
+    lat2, lon2 = np.asarray(lat2, dtype=float).ravel(), np.asarray(lon2, dtype=float).ravel()
+    return geodesic_distance(lat1[:, np.newaxis], lon1[:, np.newaxis], lat2[np.newaxis, :], lon2[np.newaxis, :], method)
@@ -2,6 +2,7 @@ from lib.util import *
 from config import configuration
 from lib.spatial_functions import define_spatial_scope, crd_merra, ind_merra, calc_geotiff
 from lib.input_maps import generate_landsea
+from lib.mask_cache import initialize_mask_cache
 
 
 def initialization():
@@ -21,6 +22,7 @@ def initialization():
 
     # import param and paths
     paths, param = configuration()
+    initialize_mask_cache(paths, param)
 
     # Read shapefile of scope
     scope_shp = gpd.read_file(paths["spatial_scope"])
@@ -1,11 +1,14 @@
 from lib.util import *
 import lib.spatial_functions as spatial_functions
+from lib.resampling import upsample
 
 
 def generate_landsea(paths, param):
     """
     This function reads the shapefiles of the countries (land areas) and of the exclusive economic zones (sea areas)
-    within the scope, and creates two rasters out of them.
+    within the scope, and creates two rasters out of them. All the land areas are rasterized in one pass, and so are all the sea areas
+    (see :mod:`spatial_functions.calc_region_union`). Pixels that belong to both are assigned to the land. Geometries that cannot be rasterized are
+    reported in a warning.
 
     :param paths: Dictionary including the paths *LAND* and *EEZ*.
     :type paths: dict
@@ -14,37 +17,21 @@ def generate_landsea(paths, param):
     :return: The tif files for *LAND* and *EEZ* are saved in their respective paths, along with their metadata in JSON files.
     :rtype: None
     """
-    m_high = param["m_high"]
-    n_high = param["n_high"]
     Crd_all = param["Crd_all"]
     res_desired = param["res_desired"]
     GeoRef = param["GeoRef"]
-    nRegions_land = param["nRegions_land"]
-    nRegions_sea = param["nRegions_sea"]
 
     timecheck("Start Land")
     # Extract land areas
     countries_shp = param["regions_land"]
-    Crd_regions_land = param["Crd_regions"][:nRegions_land]
-    Ind = spatial_functions.ind_merra(Crd_regions_land, Crd_all, res_desired)
-    A_land = np.zeros((m_high, n_high))
-    status = 0
-    for reg in range(0, param["nRegions_land"]):
-        # Show status bar
-        display_progress("Creating A_land ", (nRegions_land, status))
-
-        # Calculate A_region
-        try:
-            A_region = spatial_functions.calc_region(countries_shp.iloc[reg], Crd_regions_land[reg, :], res_desired, GeoRef)
-        except:
-            continue
-        # Include A_region in A_land
-        A_land[(Ind[reg, 2] - 1) : Ind[reg, 0], (Ind[reg, 3] - 1) : Ind[reg, 1]] = (
-            A_land[(Ind[reg, 2] - 1) : Ind[reg, 0], (Ind[reg, 3] - 1) : Ind[reg, 1]] + A_region
-        )
-        status = status + 1
+    A_land, failed = spatial_functions.calc_region_union(countries_shp, Crd_all, res_desired, GeoRef)
+    if len(failed):
+        warn("Land areas could not be rasterized: " + ", ".join(countries_shp.iloc[failed]["GID_0"].astype(str)), UserWarning)
+
     # Saving file
-    spatial_functions.array2raster(paths["LAND"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_land)
+    spatial_functions.array2raster(
+        paths["LAND"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_land, **param["raster_output"]
+    )
     create_json(
         paths["LAND"], param, ["region_name", "m_high", "n_high", "Crd_all", "res_desired", "GeoRef", "nRegions_land"], paths, ["Countries", "LAND"]
     )
@@ -54,28 +41,14 @@ def generate_landsea(paths, param):
     timecheck("Start Sea")
     # Extract sea areas
     eez_shp = param["regions_sea"]
-    Crd_regions_sea = param["Crd_regions"][-nRegions_sea:]
-    Ind = spatial_functions.ind_merra(Crd_regions_sea, Crd_all, res_desired)
-    A_sea = np.zeros((m_high, n_high))
-    status = 0
-    for reg in range(0, param["nRegions_sea"]):
-        # Show status bar
-        display_progress("Creating A_land ", (param["nRegions_sea"], status))
-
-        # Calculate A_region
-        A_region = spatial_functions.calc_region(eez_shp.iloc[reg], Crd_regions_sea[reg, :], res_desired, GeoRef)
-
-        # Include A_region in A_sea
-        A_sea[(Ind[reg, 2] - 1) : Ind[reg, 0], (Ind[reg, 3] - 1) : Ind[reg, 1]] = (
-            A_sea[(Ind[reg, 2] - 1) : Ind[reg, 0], (Ind[reg, 3] - 1) : Ind[reg, 1]] + A_region
-        )
-        status = status + 1
+    A_sea, failed = spatial_functions.calc_region_union(eez_shp, Crd_all, res_desired, GeoRef)
+    if len(failed):
+        warn("Sea areas could not be rasterized: " + ", ".join(eez_shp.iloc[failed]["ISO_Ter1"].astype(str)), UserWarning)
 
     # Fixing pixels on the borders to avoid duplicates
-    A_sea[A_sea > 0] = 1
     A_sea[A_land > 0] = 0
     # Saving file
-    spatial_functions.array2raster(paths["EEZ"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_sea)
+    spatial_functions.array2raster(paths["EEZ"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_sea, **param["raster_output"])
     create_json(
         paths["EEZ"], param, ["region_name", "m_high", "n_high", "Crd_all", "res_desired", "GeoRef", "nRegions_sea"], paths, ["EEZ_global", "EEZ"]
     )
@@ -105,7 +78,7 @@ def generate_landuse(paths, param):
     with rasterio.open(paths["LU_global"]) as src:
         w = src.read(1, window=windows.Window.from_slices(slice(Ind[0] - 1, Ind[2]), slice(Ind[3] - 1, Ind[1])))
     w = np.flipud(w)
-    spatial_functions.array2raster(paths["LU"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], w)
+    spatial_functions.array2raster(paths["LU"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], w, **param["raster_output"])
     create_json(paths["LU"], param, ["region_name", "Crd_all", "res_desired", "GeoRef"], paths, ["LU_global", "LU"])
     print("files saved: " + paths["LU"])
     timecheck("End")
@@ -114,7 +87,8 @@ def generate_landuse(paths, param):
 def generate_population(paths, param):
     """
     This function reads the global map of population density, resizes it, and creates a raster out of it for the desired scope.
-    The values are in population per pixel.
+    The values are in population per pixel. Only the window of the global map that covers the scope is read, and it is upsampled
+    by replicating each pixel into 2x2 pixels, so that the memory needed depends on the size of the scope.
     
     :param paths: Dictionary including the paths to the global population raster *Pop_global* and to the output path *POP*.
     :type paths: dict
@@ -129,13 +103,27 @@ def generate_population(paths, param):
     Crd_all = param["Crd_all"]
     Ind = spatial_functions.ind_global(Crd_all, res_desired)[0]
     GeoRef = param["GeoRef"]
+
+    # Rows and columns of the scope in the global map at the desired resolution (1/240°), and in the source map (1/120°)
+    row_start, row_end, col_start, col_end = Ind[0] - 1, Ind[2], Ind[3] - 1, Ind[1]
+    src_row_start, src_row_end = row_start // 2, (row_end + 1) // 2
+    src_col_start, src_col_end = col_start // 2, (col_end + 1) // 2
+
+    # Read the window of the source map, which is only between latitudes -60 and 85 (global rows 600 to 18000)
+    A_POP_part = np.zeros((src_row_end - src_row_start, src_col_end - src_col_start))
     with rasterio.open(paths["Pop_global"]) as src:
-        A_POP_part = src.read(1)  # map is only between latitudes -60 and 85
-    A_POP = np.zeros((21600, 43200))
-    A_POP[600:18000, :] = A_POP_part
-    A_POP = resizem(A_POP, 180 * 240, 360 * 240) / 4  # density is divided by 4
-    A_POP = np.flipud(A_POP[Ind[0] - 1 : Ind[2], Ind[3] - 1 : Ind[1]])
-    spatial_functions.array2raster(paths["POP"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_POP)
+        read_start = max(src_row_start - 600, 0)
+        read_end = min(src_row_end - 600, src.height)
+        if read_start < read_end:
+            A_POP_part[read_start + 600 - src_row_start : read_end + 600 - src_row_start, :] = src.read(
+                1, window=windows.Window.from_slices(slice(read_start, read_end), slice(src_col_start, src_col_end))
+            )
+
+    # Replicate each pixel into 2x2 pixels, then crop to the scope
+    A_POP = upsample(A_POP_part, 2, 2) / 4  # density is divided by 4
+    A_POP = A_POP[row_start - 2 * src_row_start : row_end - 2 * src_row_start, col_start - 2 * src_col_start : col_end - 2 * src_col_start]
+    A_POP = np.flipud(A_POP)
+    spatial_functions.array2raster(paths["POP"], GeoRef["RasterOrigin"], GeoRef["pixelWidth"], GeoRef["pixelHeight"], A_POP, **param["raster_output"])
     create_json(paths["POP"], param, ["region_name", "Crd_all", "res_desired", "GeoRef"], paths, ["Pop_global", "POP"])
     print("\nfiles saved: " + paths["POP"])
     timecheck("End")
@@ -143,13 +131,14 @@ def generate_population(paths, param):
 
 def generate_protected_areas(paths, param):
     """
-    This function reads the shapefile of the globally protected areas, adds an attribute whose values are based on the dictionary 
-    of conversion (protected_areas) to identify the protection category, then converts the shapefile into a raster for the scope.
+    This function reads the protected areas that intersect the spatial scope from the shapefile of the globally protected areas, and copies them into
+    a layer in memory with an attribute whose values are based on the dictionary of conversion (protected_areas) to identify the protection category.
+    Then it converts the layer in memory into a raster for the scope. The shapefile itself is opened read-only and is never modified.
     The values are integers from 0 to 10.
 
     :param paths: Dictionary including the paths to the shapefile of the globally protected areas, to the landuse raster of the scope, and to the output path PA.
     :type paths: dict
-    :param param: Dictionary including the dictionary of conversion of protection categories (protected_areas).
+    :param param: Dictionary including the dictionary of conversion of protection categories (protected_areas) and the coordinates of the bounding box of the spatial scope.
     :type param: dict
     :return: The tif file for PA is saved in its respective path, along with its metadata in a JSON file.
     :rtype: None
@@ -157,6 +146,7 @@ def generate_protected_areas(paths, param):
 
     timecheck("Start")
     protected_areas = param["protected_areas"]
+    Crd_all = param["Crd_all"]
     # set up protected areas dictionary
     protection_type = dict(zip(protected_areas["IUCN_Category"], protected_areas["type"]))
 
@@ -173,28 +163,38 @@ def generate_protected_areas(paths, param):
 
     raster_ds = None
     shp_path = paths["Protected"]
-    # Open the dataset from the file
-    dataset = ogr.Open(shp_path, 1)
+    # Open the dataset from the file (read-only), and only keep the features within the scope
+    dataset = ogr.Open(shp_path, 0)
     layer = dataset.GetLayerByIndex(0)
+    layer.SetSpatialFilterRect(Crd_all[3], Crd_all[2], Crd_all[1], Crd_all[0])
 
-    # Add a new field
-    if not field_exists("Raster", shp_path):
-        new_field = ogr.FieldDefn("Raster", ogr.OFTInteger)
-        layer.CreateField(new_field)
-
-        for feat in layer:
-            pt = feat.GetField("IUCN_CAT")
-            feat.SetField("Raster", protection_type[pt])
-            layer.SetFeature(feat)
-            feat = None
-
-    # Create a second (modified) layer
+    # Create a second (modified) layer in memory, with the protection type in the field Raster
     outdriver = ogr.GetDriverByName("MEMORY")
     source = outdriver.CreateDataSource("memData")
+    mem_layer = source.CreateLayer("protected_areas", layer.GetSpatialRef(), layer.GetGeomType())
+    mem_layer.CreateField(ogr.FieldDefn("Raster", ogr.OFTInteger))
+    mem_defn = mem_layer.GetLayerDefn()
+    unknown = set()
+    for feat in layer:
+        pt = feat.GetField("IUCN_CAT")
+        if pt not in protection_type:
+            unknown.add(pt)
+        mem_feat = ogr.Feature(mem_defn)
+        mem_feat.SetGeometry(feat.GetGeometryRef())
+        mem_feat.SetField("Raster", protection_type.get(pt, 0))
+        mem_layer.CreateFeature(mem_feat)
+        mem_feat = None
+        feat = None
+    layer = None
+    dataset = None
+    if len(unknown):
+        warn("Unknown IUCN categories are rasterized as 0: " + ", ".join(sorted(str(pt) for pt in unknown)), UserWarning)
 
     # Create the raster dataset
     memory_driver = gdal.GetDriverByName("GTiff")
-    out_raster_ds = memory_driver.Create(paths["PA"], ncol, nrow, 1, gdal.GDT_Byte)
+    out_raster_ds = memory_driver.Create(
+        paths["PA"], ncol, nrow, 1, gdal.GDT_Byte, ["TILED=YES", "COMPRESS=" + param["raster_output"]["compression"]]
+    )
 
     # Set the ROI image's projection and extent to our input raster's projection and extent
     out_raster_ds.SetProjection(proj)
@@ -208,7 +208,7 @@ def generate_protected_areas(paths, param):
     gdal.RasterizeLayer(
         out_raster_ds,  # output to our new dataset
         [1],  # output to our new dataset's first band
-        layer,  # rasterize this layer
+        mem_layer,  # rasterize this layer
         None,
         None,  # don't worry about transformations since we're in same projection
         [0],  # burn value 0
@@ -221,5 +221,6 @@ def generate_protected_areas(paths, param):
 
     # Close dataset
     out_raster_ds = None
+    source = None
     print("files saved: " + paths["PA"])
     timecheck("End")
@@ -0,0 +1,151 @@
+from lib.util import *
+
+# State of the cache, set by initialize_mask_cache() and shared by all the modules that rasterize regions.
+cache = {"enabled": False, "folder": None, "max_size": 0, "size": 0, "hits": 0, "misses": 0}
+
+
+def initialize_mask_cache(paths, param):
+    """
+    This function activates the on-disk cache of region masks used by :mod:`lib.spatial_functions.calc_region_window`. Masks are stored in the
+    folder *mask_cache* as compressed NPZ files, which only contain the window of the mask within the spatial scope and its pixels packed as bits.
+    The cache is reused across stages and across runs by the functions that rasterize one region at a time (the sites, the distribution of
+    renewable power plants, and the zonal statistics in the mode ``'region'``). If the size of the folder exceeds the limit *max_size_MB*, the
+    masks that have not been used for the longest time are deleted.
+
+    :param paths: Dictionary including the path to the folder *mask_cache*.
+    :type paths: dict
+    :param param: Dictionary including the dictionary *mask_cache* with the keys *enabled* and *max_size_MB*.
+    :type param: dict
+
+    :return: The cache is initialized and the counters of hits and misses are reset.
+    :rtype: None
+    """
+    cache["enabled"] = param["mask_cache"]["enabled"]
+    cache["folder"] = paths["mask_cache"]
+    cache["max_size"] = param["mask_cache"]["max_size_MB"] * 1024 ** 2
+    cache["hits"] = 0
+    cache["misses"] = 0
+    if not cache["enabled"]:
+        return
+    if not os.path.isdir(cache["folder"]):
+        os.makedirs(cache["folder"])
+    cache["size"] = sum(entry.stat().st_size for entry in os.scandir(cache["folder"]) if entry.name.endswith(".npz"))
+
+
+def mask_key(geom, res_desired, GeoRef, shape):
+    """
+    This function returns the key of a region mask in the cache. It is a hash of the geometry in WKB format, of the resolution, and of the
+    georeference and size of the raster of the spatial scope.
+
+    :param geom: Geometry of the region.
+    :type geom: shapely geometry
+    :param res_desired: Desired high resolution of the masking raster.
+    :type res_desired: list
+    :param GeoRef: Georeference dictionary containing *RasterOrigin*, *RasterOrigin_alt*, *pixelWidth*, and *pixelHeight*.
+    :type GeoRef: dict
+    :param shape: Number of rows and columns of the raster of the spatial scope.
+    :type shape: tuple(int, int)
+
+    :return key: Hexadecimal hash of the inputs.
+    :rtype: string
+    """
+    h = hashlib.sha1(geom.wkb)
+    grid = [res_desired[0], res_desired[1], GeoRef["pixelWidth"], GeoRef["pixelHeight"]]
+    grid = grid + list(GeoRef["RasterOrigin"]) + list(GeoRef["RasterOrigin_alt"])
+    h.update(np.array(grid, dtype=float).tobytes())
+    h.update(np.array(shape, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def load_mask(key):
+    """
+    This function reads a region mask from the cache, if it exists, and updates the counters of hits and misses.
+
+    :param key: Key of the mask, as returned by :mod:`mask_key`.
+    :type key: string
+
+    :return: The masking raster and its window within the spatial scope, or ``None`` if the mask is not in the cache.
+    :rtype: tuple(numpy array, tuple(slice, slice)) or None
+    """
+    if not cache["enabled"]:
+        return None
+    path = os.path.join(cache["folder"], key + ".npz")
+    try:
+        with np.load(path) as f:
+            rows, cols = f["window"]
+            shape = (rows[1] - rows[0], cols[1] - cols[0])
+            A_region = np.unpackbits(f["bits"])[: shape[0] * shape[1]].reshape(shape).astype(float)
+        os.utime(path)
+    except (OSError, KeyError, ValueError):
+        cache["misses"] = cache["misses"] + 1
+        return None
+    cache["hits"] = cache["hits"] + 1
+    return A_region, (slice(int(rows[0]), int(rows[1])), slice(int(cols[0]), int(cols[1])))
+
+
+def save_mask(key, A_region, window):
+    """
+    This function saves a region mask into the cache, then deletes the least recently used masks if the cache has grown beyond its size limit.
+
+    :param key: Key of the mask, as returned by :mod:`mask_key`.
+    :type key: string
+    :param A_region: Masking raster of the region (1 inside, 0 outside).
+    :type A_region: numpy array
+    :param window: Row and column slices of the masking raster within the spatial scope.
+    :type window: tuple(slice, slice)
+
+    :return: The mask is saved in the folder of the cache.
+    :rtype: None
+    """
+    if not cache["enabled"]:
+        return
+    path = os.path.join(cache["folder"], key + ".npz")
+    rows, cols = window
+    # Write to a temporary file first, so that a mask is never read while it is being written (also by other processes)
+    path_temp = path + "." + str(os.getpid()) + ".tmp"
+    with open(path_temp, "wb") as f:
+        np.savez_compressed(f, bits=np.packbits(A_region > 0), window=np.array([[rows.start, rows.stop], [cols.start, cols.stop]]))
+    # If the mask is overwritten, only the difference of size is added to the size of the cache
+    try:
+        size_old = os.path.getsize(path)
+    except OSError:
+        size_old = 0
+    os.replace(path_temp, path)
+    cache["size"] = cache["size"] - size_old + os.path.getsize(path)
+
+    if cache["size"] > cache["max_size"]:
+        entries = sorted((entry for entry in os.scandir(cache["folder"]) if entry.name.endswith(".npz")), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if cache["size"] <= cache["max_size"]:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                # Already deleted by another process
+                continue
+            cache["size"] = cache["size"] - size
+
+
+def report_mask_cache():
+    """
+    This function prints the number of hits and misses of the cache of region masks since it was initialized.
+
+    :return: The counters are printed.
+    :rtype: None
+    """
+    if not cache["enabled"]:
+        return
+    total = cache["hits"] + cache["misses"]
+    print(
+        "Region mask cache: "
+        + str(cache["hits"])
+        + " hits, "
+        + str(cache["misses"])
+        + " misses"
+        + (" (" + str(round(100 * cache["hits"] / total)) + "% hit rate)" if total else "")
+        + " - "
+        + str(round(cache["size"] / 1024 ** 2, 1))
+        + " MB in "
+        + cache["folder"]
+    )
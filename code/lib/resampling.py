@@ -0,0 +1,157 @@
+from lib.util import *
+
+
+def upsample_blocks(A_in, row_factor, col_factor):
+    """
+    This function upsamples a raster by integer factors without copying it. Each pixel is repeated into a block of *row_factor* x *col_factor*
+    pixels, as a read-only broadcast view with four dimensions (rows, rows within the block, columns, columns within the block).
+    The view can be combined directly with a fine raster of the same size reshaped with :mod:`split_blocks`.
+
+    :param A_in: Input raster.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+
+    :return A_out: Upsampled raster as a view of *A_in* of shape (m, row_factor, n, col_factor).
+    :rtype: numpy array
+    """
+    m, n = A_in.shape
+    return np.broadcast_to(A_in[:, np.newaxis, :, np.newaxis], (m, row_factor, n, col_factor))
+
+
+def split_blocks(A_in, row_factor, col_factor):
+    """
+    This function reshapes a raster into blocks of *row_factor* x *col_factor* pixels, without copying it. The number of rows and columns
+    must be multiples of the factors.
+
+    :param A_in: Input raster.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+
+    :return A_out: View of *A_in* of shape (m / row_factor, row_factor, n / col_factor, col_factor).
+    :rtype: numpy array
+    """
+    m, n = A_in.shape
+    if m % row_factor or n % col_factor:
+        raise Exception("The shape " + str(A_in.shape) + " is not a multiple of the factors (" + str(row_factor) + ", " + str(col_factor) + ").")
+    return A_in.reshape((m // row_factor, row_factor, n // col_factor, col_factor))
+
+
+def upsample(A_in, row_factor, col_factor):
+    """
+    This function upsamples a raster by integer factors, by replicating each pixel into a block of *row_factor* x *col_factor* pixels.
+    If both factors are equal to 1, the input raster is returned without copy.
+
+    :param A_in: Input raster.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+
+    :return A_out: Upsampled raster of shape (m * row_factor, n * col_factor).
+    :rtype: numpy array
+    """
+    if row_factor == 1 and col_factor == 1:
+        return A_in
+    m, n = A_in.shape
+    return upsample_blocks(A_in, row_factor, col_factor).reshape((m * row_factor, n * col_factor))
+
+
+def downsample(A_in, row_factor, col_factor, method="sum"):
+    """
+    This function downsamples a raster by integer factors, by aggregating each block of *row_factor* x *col_factor* pixels into one pixel:
+
+      * ``'sum'``: the sum of the block, for quantities per pixel such as population.
+      * ``'mean'``: the mean of the block, for densities.
+      * ``'mode'``: the most frequent value of the block, for classes such as land use. The input must contain integers.
+        In case of a tie, the smallest value is returned.
+
+    :param A_in: Input raster, whose number of rows and columns are multiples of the factors.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+    :param method: Aggregation method, either ``'sum'``, ``'mean'``, or ``'mode'``.
+    :type method: string
+
+    :return A_out: Downsampled raster of shape (m / row_factor, n / col_factor).
+    :rtype: numpy array
+    """
+    A_blocks = split_blocks(A_in, row_factor, col_factor)
+    if method == "sum":
+        return A_blocks.sum(axis=(1, 3))
+    if method == "mean":
+        return A_blocks.mean(axis=(1, 3))
+    if method == "mode":
+        if not np.issubdtype(A_in.dtype, np.integer):
+            raise Exception("The mode can only be calculated for integer rasters, not for " + str(A_in.dtype) + ".")
+        m, n = A_blocks.shape[0], A_blocks.shape[2]
+        if not A_in.size:
+            return np.zeros((m, n), dtype=A_in.dtype)
+        # Count the values of each block with one bincount over (block, value) codes
+        A_blocks = A_blocks.transpose((0, 2, 1, 3)).reshape((m * n, row_factor * col_factor))
+        val_min = int(A_blocks.min())
+        n_val = int(A_blocks.max()) - val_min + 1
+        codes = np.arange(m * n)[:, np.newaxis] * n_val + (A_blocks - val_min)
+        counts = np.bincount(codes.ravel(), minlength=m * n * n_val).reshape((m * n, n_val))
+        return (counts.argmax(axis=1) + val_min).astype(A_in.dtype).reshape((m, n))
+    raise Exception("Unknown resampling method: " + str(method))
+
+
+def upsample_chunked(A_in, row_factor, col_factor, A_out, chunk_rows=1000):
+    """
+    This function upsamples a raster like :mod:`upsample`, but in stripes of *chunk_rows* input rows written into *A_out*. It is meant for rasters
+    that do not fit in memory once upsampled: *A_in* and *A_out* can be memory-mapped arrays (``np.memmap`` or ``np.load`` with *mmap_mode*).
+
+    :param A_in: Input raster.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+    :param A_out: Output raster of shape (m * row_factor, n * col_factor).
+    :type A_out: numpy array
+    :param chunk_rows: Number of input rows processed at once.
+    :type chunk_rows: integer
+
+    :return A_out: The output raster, filled.
+    :rtype: numpy array
+    """
+    for row in range(0, A_in.shape[0], chunk_rows):
+        A_chunk = np.asarray(A_in[row : row + chunk_rows])
+        A_out[row * row_factor : (row + len(A_chunk)) * row_factor] = upsample(A_chunk, row_factor, col_factor)
+    return A_out
+
+
+def downsample_chunked(A_in, row_factor, col_factor, A_out, method="sum", chunk_rows=1000):
+    """
+    This function downsamples a raster like :mod:`downsample`, but in stripes of *chunk_rows* output rows written into *A_out*. It is meant for
+    rasters that do not fit in memory: *A_in* and *A_out* can be memory-mapped arrays (``np.memmap`` or ``np.load`` with *mmap_mode*).
+
+    :param A_in: Input raster, whose number of rows and columns are multiples of the factors.
+    :type A_in: numpy array
+    :param row_factor: Number of rows of each block.
+    :type row_factor: integer
+    :param col_factor: Number of columns of each block.
+    :type col_factor: integer
+    :param A_out: Output raster of shape (m / row_factor, n / col_factor).
+    :type A_out: numpy array
+    :param method: Aggregation method, either ``'sum'``, ``'mean'``, or ``'mode'``.
+    :type method: string
+    :param chunk_rows: Number of output rows processed at once.
+    :type chunk_rows: integer
+
+    :return A_out: The output raster, filled.
+    :rtype: numpy array
+    """
+    for row in range(0, A_out.shape[0], chunk_rows):
+        A_chunk = np.asarray(A_in[row * row_factor : (row + chunk_rows) * row_factor])
+        A_out[row : row + len(A_chunk) // row_factor] = downsample(A_chunk, row_factor, col_factor, method)
+    return A_out
@@ -1,5 +1,13 @@
 from lib.input_maps import generate_protected_areas
 from lib.util import *
+import lib.mask_cache as mask_cache
+
+# Rasters shared with the worker processes of zonal_stats, set by zonal_stats_worker_init() in each worker.
+shared_rasters = {}
+# Locators of regions built by region_locator(), keyed by a hash of the regions.
+region_locators = {}
+# Number of rows of the rasters processed at once by zonal_stats_label_raster(), also used by zonal_stats_region() to sum in the same order.
+zonal_stats_stripe = 1000
 
 
 def define_spatial_scope(scope_shp):
@@ -187,9 +195,161 @@ def calc_region(region, Crd_reg, res_desired, GeoRef):
     return A_region
 
 
-def array2raster(newRasterfn, rasterOrigin, pixelWidth, pixelHeight, array):
+def calc_region_window(region, Crd_all, res_desired, GeoRef):
+    """
+    This function reads the region geometry, and returns a masking raster equal to 1 for pixels within and 0 outside of
+    the region, like :mod:`calc_region`. However, the masking raster only covers the bounding box of the region (cropped to the
+    spatial scope), and is returned along with its window in the raster of the spatial scope. Data rasters of the scope can then be
+    sliced directly with that window, e.g. ``A_region * A_data[window]``.
+    If the cache of region masks is enabled (see :mod:`lib.mask_cache`), the mask is read from the cache instead of being rasterized again.
+
+    :param region: Region geometry
+    :type region: Geopandas series
+    :param Crd_all: Coordinates of the bounding box of the spatial scope.
+    :type Crd_all: numpy array
+    :param res_desired: Desired high resolution of the output raster
+    :type res_desired: list
+    :param GeoRef: Georeference dictionary containing *RasterOrigin*, *RasterOrigin_alt*, *pixelWidth*, and *pixelHeight*.
+    :type GeoRef: dict
+
+    :return (A_region, window): Masking raster of the region, and tuple of row and column slices of the window within the spatial scope.
+    :rtype: tuple(numpy array, tuple(slice, slice))
+    """
+    M = int(math.fabs(Crd_all[2] - Crd_all[0]) / res_desired[0])
+    N = int(math.fabs(Crd_all[3] - Crd_all[1]) / res_desired[1])
+
+    # Look for the mask in the cache
+    key = None
+    if mask_cache.cache["enabled"]:
+        key = mask_cache.mask_key(region.geometry, res_desired, GeoRef, (M, N))
+        cached = mask_cache.load_mask(key)
+        if cached is not None:
+            return cached
+
+    # Snap the bounding box of the region to the pixels of the scope (rows start in the South, like in calc_region)
+    minx, miny, maxx, maxy = region.geometry.bounds
+    row_start = int(min(max(np.floor((miny - Crd_all[2]) / res_desired[0]), 0), M))
+    row_end = int(min(max(np.ceil((maxy - Crd_all[2]) / res_desired[0]), row_start), M))
+    col_start = int(min(max(np.floor((minx - Crd_all[3]) / res_desired[1]), 0), N))
+    col_end = int(min(max(np.ceil((maxx - Crd_all[3]) / res_desired[1]), col_start), N))
+    window = (slice(row_start, row_end), slice(col_start, col_end))
+
+    if row_start == row_end or col_start == col_end:
+        return np.zeros((row_end - row_start, col_end - col_start)), window
+
+    transform = rasterio.transform.from_origin(
+        Crd_all[3] + col_start * res_desired[1], Crd_all[2] + row_start * res_desired[0], GeoRef["pixelWidth"], GeoRef["pixelHeight"]
+    )
+    A_region = features.geometry_mask(
+        [region.geometry], out_shape=(row_end - row_start, col_end - col_start), transform=transform, all_touched=False, invert=True
+    ).astype(float)
+
+    if key is not None:
+        mask_cache.save_mask(key, A_region, window)
+
+    return A_region, window
+
+
+def calc_region_labels(regions_shp, Crd_all, res_desired, GeoRef):
     """
-    This function saves array to geotiff raster format based on EPSG 4326.
+    This function rasterizes all the regions of a geodataframe at once, and returns rasters of region IDs instead of one masking
+    raster per region. Each pixel is equal to the position of its region in *regions_shp* plus one, and to 0 outside of all regions.
+    Regions whose interiors overlap cannot share the same raster, so they are distributed over several label rasters (layers).
+    The pixels assigned to each region are the same as in :mod:`calc_region`.
+
+    :param regions_shp: Geodataframe containing the regions to be rasterized.
+    :type regions_shp: geodataframe
+    :param Crd_all: Coordinates of the bounding box of the spatial scope.
+    :type Crd_all: numpy array
+    :param res_desired: Desired high resolution of the output rasters.
+    :type res_desired: list
+    :param GeoRef: Georeference dictionary containing *RasterOrigin*, *RasterOrigin_alt*, *pixelWidth*, and *pixelHeight*.
+    :type GeoRef: dict
+
+    :return layers: List of label rasters, with the same orientation as the masking rasters of :mod:`calc_region`.
+    :rtype: list of numpy arrays
+    """
+    latlim = Crd_all[2] - Crd_all[0]
+    lonlim = Crd_all[3] - Crd_all[1]
+    M = int(math.fabs(latlim) / res_desired[0])
+    N = int(math.fabs(lonlim) / res_desired[1])
+    transform = rasterio.transform.from_origin(Crd_all[3], Crd_all[2], GeoRef["pixelWidth"], GeoRef["pixelHeight"])
+    geoms = list(regions_shp.geometry)
+    nRegions = len(geoms)
+
+    # Assign each region to the first layer that does not contain a region overlapping with it
+    sindex = regions_shp.sindex
+    layer_of = np.zeros(nRegions, dtype=int)
+    for reg in range(0, nRegions):
+        if geoms[reg] is None or geoms[reg].is_empty:
+            continue
+        taken = set()
+        for other in sindex.intersection(geoms[reg].bounds):
+            if other < reg and geoms[other] is not None and geoms[reg].intersects(geoms[other]) and not geoms[reg].touches(geoms[other]):
+                taken.add(layer_of[other])
+        while layer_of[reg] in taken:
+            layer_of[reg] = layer_of[reg] + 1
+
+    dtype = "uint16" if nRegions < np.iinfo(np.uint16).max else "uint32"
+    layers = []
+    for layer in range(0, layer_of.max() + 1 if nRegions else 0):
+        shapes = [(geoms[reg], reg + 1) for reg in np.flatnonzero(layer_of == layer) if geoms[reg] is not None and not geoms[reg].is_empty]
+        if not len(shapes):
+            continue
+        layers.append(features.rasterize(shapes, out_shape=(M, N), transform=transform, fill=0, all_touched=False, dtype=dtype))
+
+    return layers
+
+
+def calc_region_union(regions_shp, Crd_all, res_desired, GeoRef):
+    """
+    This function rasterizes all the regions of a geodataframe in one pass into a single masking raster of the spatial scope, which is
+    equal to 1 inside any of the regions and to 0 elsewhere. The pixels are the same as those of :mod:`calc_region` for each region.
+    Geometries that are missing or empty are left out, and invalid geometries are repaired with a zero-width buffer if possible.
+    The positions of the geometries that could not be rasterized are returned, so that they can be reported.
+
+    :param regions_shp: Geodataframe containing the regions to be rasterized.
+    :type regions_shp: geodataframe
+    :param Crd_all: Coordinates of the bounding box of the spatial scope.
+    :type Crd_all: numpy array
+    :param res_desired: Desired high resolution of the output raster.
+    :type res_desired: list
+    :param GeoRef: Georeference dictionary containing *RasterOrigin*, *RasterOrigin_alt*, *pixelWidth*, and *pixelHeight*.
+    :type GeoRef: dict
+
+    :return (A_union, failed): Masking raster of the union of the regions, with the same orientation as the masking rasters of :mod:`calc_region`,
+        and list of the positions in *regions_shp* of the geometries that were left out.
+    :rtype: tuple(numpy array, list)
+    """
+    latlim = Crd_all[2] - Crd_all[0]
+    lonlim = Crd_all[3] - Crd_all[1]
+    M = int(math.fabs(latlim) / res_desired[0])
+    N = int(math.fabs(lonlim) / res_desired[1])
+    transform = rasterio.transform.from_origin(Crd_all[3], Crd_all[2], GeoRef["pixelWidth"], GeoRef["pixelHeight"])
+
+    # Check the geometries before rasterizing them together, since a single bad geometry would fail the whole call
+    shapes = []
+    failed = []
+    for reg, geom in enumerate(regions_shp.geometry):
+        if geom is not None and not geom.is_empty and not geom.is_valid:
+            geom = geom.buffer(0)
+        if geom is None or geom.is_empty or not geom.is_valid:
+            failed.append(reg)
+            continue
+        shapes.append((geom, 1))
+
+    if not len(shapes):
+        return np.zeros((M, N)), failed
+    A_union = features.rasterize(shapes, out_shape=(M, N), transform=transform, fill=0, all_touched=False, dtype="uint8")
+
+    return A_union.astype(float), failed
+
+
+def array2raster(newRasterfn, rasterOrigin, pixelWidth, pixelHeight, array, compression="DEFLATE", overviews=None):
+    """
+    This function saves array to geotiff raster format based on EPSG 4326. The raster is stored with the smallest data type that
+    represents all the values of the array exactly (see :mod:`raster_data_type`). It is internally tiled and compressed, with a predictor
+    adapted to the data type, and overviews can be added for a faster display in GIS software.
 
     :param newRasterfn: Output path of the raster.
     :type newRasterfn: string
@@ -201,6 +361,10 @@ def array2raster(newRasterfn, rasterOrigin, pixelWidth, pixelHeight, array):
     :type pixelHeight: integer
     :param array: Array to be converted into a raster.
     :type array: numpy array
+    :param compression: Compression of the GeoTIFF file, for example ``'DEFLATE'``, ``'ZSTD'`` (if supported by GDAL), or ``'PACKBITS'``.
+    :type compression: string
+    :param overviews: Decimation factors of the overviews, for example ``[2, 4, 8, 16]``. No overviews are built if it is empty or ``None``.
+    :type overviews: list
 
     :return: The raster file will be saved in the desired path *newRasterfn*.
     :rtype: None
@@ -209,17 +373,77 @@ def array2raster(newRasterfn, rasterOrigin, pixelWidth, pixelHeight, array):
     rows = array.shape[0]
     originX = rasterOrigin[0]
     originY = rasterOrigin[1]
+    data_type, array = raster_data_type(array)
+
+    options = ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "COMPRESS=" + compression, "BIGTIFF=IF_SAFER"]
+    if array.dtype == bool:
+        # Masks are stored as bits, for which no predictor is supported
+        options.append("NBITS=1")
+    elif compression in ["DEFLATE", "ZSTD", "LZW"]:
+        # Horizontal differencing for integers, floating point predictor for floats
+        options.append("PREDICTOR=3" if data_type in [gdal.GDT_Float32, gdal.GDT_Float64] else "PREDICTOR=2")
 
     driver = gdal.GetDriverByName("GTiff")
-    outRaster = driver.Create(newRasterfn, cols, rows, 1, gdal.GDT_Float64, ["COMPRESS=PACKBITS"])
+    outRaster = driver.Create(newRasterfn, cols, rows, 1, data_type, options)
     outRaster.SetGeoTransform((originX, pixelWidth, 0, originY, 0, pixelHeight))
     outRasterSRS = osr.SpatialReference()
     outRasterSRS.ImportFromEPSG(4326)
     outRaster.SetProjection(outRasterSRS.ExportToWkt())
     outband = outRaster.GetRasterBand(1)
-    outband.WriteArray(np.flipud(array))
+    outband.WriteArray(np.flipud(array).astype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type), copy=False))
     outband.FlushCache()
     outband = None
+    if overviews:
+        outRaster.BuildOverviews("AVERAGE" if data_type in [gdal.GDT_Float32, gdal.GDT_Float64] else "NEAREST", overviews)
+    outRaster = None
+
+
+def raster_data_type(array):
+    """
+    This function finds the smallest GDAL data type that represents all the values of an array exactly:
+
+      * Arrays of zeros and ones (masks) are stored as bits (*Byte* with *NBITS=1*), and returned as boolean arrays.
+      * Arrays of integers (also if stored as floats) are stored as *Byte*, *UInt16*, *Int16*, *UInt32*, or *Int32*.
+      * Other arrays are stored as *Float32* if no precision is lost, and as *Float64* otherwise.
+
+    :param array: Array to be saved as a raster.
+    :type array: numpy array
+
+    :return (data_type, array): GDAL data type, and the array (converted to boolean if it is a mask).
+    :rtype: tuple(int, numpy array)
+    """
+    if array.dtype == bool:
+        return gdal.GDT_Byte, array
+    if not array.size:
+        return gdal.GDT_Float64, array
+
+    if np.issubdtype(array.dtype, np.integer):
+        integers = True
+    else:
+        # Floats are only integers if they are all finite and without decimals
+        with np.errstate(invalid="ignore"):
+            integers = bool(np.isfinite(array).all() and (np.mod(array, 1) == 0).all())
+
+    if integers:
+        val_min = array.min()
+        val_max = array.max()
+        if val_min >= 0 and val_max <= 1:
+            return gdal.GDT_Byte, array == 1
+        for data_type, numeric_type in [
+            (gdal.GDT_Byte, np.uint8),
+            (gdal.GDT_UInt16, np.uint16),
+            (gdal.GDT_Int16, np.int16),
+            (gdal.GDT_UInt32, np.uint32),
+            (gdal.GDT_Int32, np.int32),
+        ]:
+            if np.iinfo(numeric_type).min <= val_min and val_max <= np.iinfo(numeric_type).max:
+                return data_type, array
+
+    # Float32 only if it does not change the values
+    with np.errstate(over="ignore", invalid="ignore"):
+        if ((array.astype(np.float32) == array) | np.isnan(array)).all():
+            return gdal.GDT_Float32, array
+    return gdal.GDT_Float64, array
 
 
 def intersection_subregions_countries(paths, param):
@@ -276,6 +500,53 @@ def intersection_subregions_countries(paths, param):
     return intersection
 
 
+def region_neighbors(paths, param):
+    """
+    This function determines the pairs of first-order neighbors among the subregions, i.e. the subregions whose geometries touch or share a
+    boundary. It works directly on the geodataframe *regions_sub*: the candidate pairs are found with a spatial join, which uses a spatial
+    index of the bounding boxes, and the intersection test is only done for these candidates. The subregions are then named as in the CSV
+    file *sites_sub* (where subregions that are mostly offshore get the suffix ``_offshore``), by matching *Index_shapefile* with the
+    original index of the shapefile. If *neighbors_cache* in the dictionary *grid* is True, the result is saved in the folder *grid_sub*
+    with a hash of the names and geometries of the subregions, and read from there in the next runs.
+
+    :param paths: Dictionary including the path to the CSV file *sites_sub* and to the folder *grid_sub*.
+    :type paths: dict
+    :param param: Dictionary including the geodataframe *regions_sub* and the dictionary *grid*.
+    :type param: dict
+
+    :return neighbors: Dataframe with the columns *Site In* and *Site Out*, with one row per pair of neighbors (sorted alphabetically within each pair).
+    :rtype: pandas dataframe
+    """
+    sites = pd.read_csv(paths["sites_sub"], index_col=0, decimal=",", sep=";")
+    site_names = pd.Series(sites.index, index=sites["Index_shapefile"].values)
+    subregions = param["regions_sub"][["geometry"]].copy()
+    subregions["Site"] = site_names.reindex(param["regions_sub"]["original_index"].values).values
+    if subregions["Site"].isnull().any():
+        warn(
+            str(subregions["Site"].isnull().sum()) + " subregions are missing in " + paths["sites_sub"] + " and are not considered as neighbors.",
+            UserWarning,
+        )
+        subregions = subregions.loc[subregions["Site"].notnull()]
+
+    if param["grid"]["neighbors_cache"]:
+        h = hashlib.sha1()
+        for name, geom in zip(subregions["Site"], subregions["geometry"]):
+            h.update(str(name).encode())
+            h.update(geom.wkb)
+        cache_path = paths["grid_sub"] + "Neighbors_" + h.hexdigest()[:16] + ".csv"
+        if os.path.isfile(cache_path):
+            return pd.read_csv(cache_path, sep=";", decimal=",")
+
+    pairs = gpd.sjoin(subregions, subregions, how="inner", op="intersects")
+    pairs = pairs.loc[pairs["Site_left"] < pairs["Site_right"], ["Site_left", "Site_right"]]
+    neighbors = pairs.rename(columns={"Site_left": "Site In", "Site_right": "Site Out"}).drop_duplicates()
+    neighbors = neighbors.sort_values(["Site In", "Site Out"]).reset_index(drop=True)
+
+    if param["grid"]["neighbors_cache"]:
+        neighbors.to_csv(cache_path, sep=";", decimal=",", index=False)
+    return neighbors
+
+
 def zonal_stats(regions_shp, raster_dict, param):
     """
     This function calculates the zonal statistics for a given shapefile and a dictionary of rasters:
@@ -283,25 +554,32 @@ def zonal_stats(regions_shp, raster_dict, param):
       * Population: the sum is calculated.
       * Landuse: the pixels for each land use type are counted.
       * other_keys: the maximum is returned.
+
+    Depending on *mode* in the dictionary *zonal_stats*, the regions are either rasterized all at once into rasters of region IDs
+    (see :mod:`zonal_stats_label_raster`), or one at a time within their bounding boxes (see :mod:`zonal_stats_region`).
+    In the mode ``'region'``, the regions can be distributed over several processes with the key *workers*. The rasters are then saved once
+    as memory-mapped files that all the workers read, and the results are collected in the order of the regions, so that they are identical
+    to those of a single process. Both modes return the same output: the sums are floats, the counts of pixels are integers (0 for the land use
+    types that are not found in a region), and the maxima are floats (NaN for the regions without any pixel).
       
     :param regions_shp: Geodataframe containing the regions for which the statistics should be calculated.
     :type regions_shp: geodataframe
     :param raster_dict: Dictionary with keys *Population*, *Landuse*, or any other string, and with paths of rasters as values.
     :type raster_dict: dict
-    :param param: Dictionary containing *landuse_types*.
+    :param param: Dictionary containing *landuse_types* and *zonal_stats*.
     :type param: dict
     
     :return df: Dataframe containing the zonal statistics, with the names of the regions as index and the keys of the statistics as columns.
     :rtype: pandas dataframe
     """
     timecheck("Start")
-    Crd_all = param["Crd_all"]
-    res_desired = param["res_desired"]
-    GeoRef = param["GeoRef"]
     nRegions = len(regions_shp)
+    workers = param["zonal_stats"]["workers"]
 
-    # Read rasters
-    for key, val in raster_dict.items():
+    # Read rasters into a local dictionary, the dictionary of paths of the caller is not modified
+    raster_paths = raster_dict
+    raster_dict = {}
+    for key, val in raster_paths.items():
         with rasterio.open(val) as src:
             raster_dict[key] = np.flipud(src.read(1))
 
@@ -317,30 +595,226 @@ def zonal_stats(regions_shp, raster_dict, param):
     if len(other_keys):
         df_columns = df_columns + other_keys
     df = pd.DataFrame(0, index=regions_shp.index, columns=df_columns)
-
-    status = 0
-    for reg in range(0, nRegions):
-        # Show status bar
+    df[other_keys] = np.nan
+
+    if param["zonal_stats"]["mode"] == "label":
+        df = zonal_stats_label_raster(regions_shp, raster_dict, other_keys, df, param)
+    elif workers > 1 and nRegions > 1:
+        # Save the rasters once as memory-mapped files, instead of sending them to the workers with each task
+        folder = tempfile.mkdtemp(prefix="zonal_stats_")
+        raster_files = {}
+        for key in raster_dict.keys():
+            raster_files[key] = os.path.join(folder, key + ".npy")
+            np.save(raster_files[key], raster_dict[key])
+        # Free the rasters in memory (only in the local dictionary), the workers read the memory-mapped files
+        for key in raster_files.keys():
+            raster_dict.pop(key)
+
+        # Hand out the regions in chunks, several per worker to balance the load
+        chunk_size = int(math.ceil(nRegions / (4 * workers)))
+        chunks = [regions_shp.iloc[i : i + chunk_size] for i in range(0, nRegions, chunk_size)]
+        stats = []
+        status = 0
+        try:
+            with Pool(processes=workers, initializer=zonal_stats_worker_init, initargs=(raster_files, other_keys, param, mask_cache.cache)) as pool:
+                for chunk_stats, hits, misses in pool.imap(zonal_stats_worker, chunks):
+                    stats = stats + chunk_stats
+                    mask_cache.cache["hits"] = mask_cache.cache["hits"] + hits
+                    mask_cache.cache["misses"] = mask_cache.cache["misses"] + misses
+                    # Show status bar
+                    status = status + len(chunk_stats)
+                    display_progress("Calculating statistics ", (nRegions, status))
+        finally:
+            shared_rasters.clear()
+            shutil.rmtree(folder, ignore_errors=True)
+    else:
+        stats = []
+        status = 0
+        for reg in range(0, nRegions):
+            # Show status bar
+            display_progress("Calculating statistics ", (nRegions, status))
+            stats.append(zonal_stats_region(regions_shp.iloc[reg], raster_dict, other_keys, param))
+            status = status + 1
         display_progress("Calculating statistics ", (nRegions, status))
 
-        # Calculate A_region_extended
-        A_region_extended = calc_region(regions_shp.loc[reg], Crd_all, res_desired, GeoRef)
-        A_region_extended[A_region_extended == 0] = np.nan
+    if param["zonal_stats"]["mode"] != "label":
+        # Fill the dataframe in the order of the regions
+        for reg in range(0, nRegions):
+            for key, value in stats[reg].items():
+                df.loc[regions_shp.index[reg], key] = value
 
-        if "Population" in raster_dict.keys():
-            df.loc[reg, "RES"] = np.nansum(A_region_extended * raster_dict["Population"])
+    # Same columns and types in both modes, with the land use types that are not in landuse_types at the end
+    df = df[df_columns + sorted([col for col in df.columns if col not in df_columns], key=int)]
+    counts = [col for col in df.columns if col != "RES" and col not in other_keys]
+    df[counts] = df[counts].fillna(0).astype(np.int64)
+    df[other_keys] = df[other_keys].astype(float)
+    if "RES" in df_columns:
+        df["RES"] = df["RES"].astype(float)
 
-        if "Landuse" in raster_dict.keys():
-            A_data = A_region_extended * raster_dict["Landuse"].astype(int)
-            unique, counts = np.unique(A_data[~np.isnan(A_data)], return_counts=True)
-            for element in range(0, len(unique)):
-                df.loc[reg, str(int(unique[element]))] = int(counts[element])
+    timecheck("End")
+    return df
 
-        for key in other_keys:
-            df.loc[reg, key] = np.nanmax(A_region_extended * raster_dict[key])
 
-        status = status + 1
-    timecheck("End")
+def zonal_stats_region(region, raster_dict, other_keys, param):
+    """
+    This function calculates the zonal statistics of :mod:`zonal_stats` for one region, using its mask within its bounding box
+    (see :mod:`calc_region_window`).
+
+    :param region: Region for which the statistics should be calculated.
+    :type region: geopandas series
+    :param raster_dict: Dictionary with keys *Population*, *Landuse*, or any other string, and with the rasters (numpy arrays) as values.
+    :type raster_dict: dict
+    :param other_keys: Keys of *raster_dict* for which the maximum is calculated.
+    :type other_keys: list
+    :param param: Dictionary containing *Crd_all*, *res_desired*, and *GeoRef*.
+    :type param: dict
+
+    :return stats: Dictionary with the names of the columns of :mod:`zonal_stats` as keys and the statistics of the region as values.
+    :rtype: dict
+    """
+    stats = {}
+
+    # Calculate A_region and its window within the scope
+    A_region, window = calc_region_window(region, param["Crd_all"], param["res_desired"], param["GeoRef"])
+    A_region[A_region == 0] = np.nan
+
+    if "Population" in raster_dict.keys():
+        # Sum in the same order as zonal_stats_label_raster(): pixel by pixel within stripes of rows of the scope, then stripe by stripe
+        rows, cols = np.nonzero(~np.isnan(A_region))
+        A_pop = raster_dict["Population"][window][rows, cols]
+        stripes = (window[0].start + rows) // zonal_stats_stripe
+        stats["RES"] = np.add.accumulate(np.r_[0.0, np.bincount(stripes, weights=np.where(np.isnan(A_pop), 0, A_pop))])[-1]
+
+    if "Landuse" in raster_dict.keys():
+        A_data = A_region * raster_dict["Landuse"][window]
+        unique, counts = np.unique(A_data[~np.isnan(A_data)], return_counts=True)
+        for element in range(0, len(unique)):
+            stats[str(int(unique[element]))] = int(counts[element])
+
+    for key in other_keys:
+        if np.isnan(A_region).all():
+            stats[key] = np.nan
+        else:
+            stats[key] = np.nanmax(A_region * raster_dict[key][window])
+
+    return stats
+
+
+def zonal_stats_worker_init(raster_files, other_keys, param, cache):
+    """
+    This function initializes a worker process of :mod:`zonal_stats`. It opens the rasters as read-only memory-mapped arrays, which are
+    shared by all the workers, and copies the state of the cache of region masks from the parent process.
+
+    :param raster_files: Dictionary with the keys of the rasters and the paths of their NPY files as values.
+    :type raster_files: dict
+    :param other_keys: Keys of the rasters for which the maximum is calculated.
+    :type other_keys: list
+    :param param: Dictionary containing *Crd_all*, *res_desired*, and *GeoRef*.
+    :type param: dict
+    :param cache: State of the cache of region masks (see :mod:`lib.mask_cache`).
+    :type cache: dict
+
+    :return: The rasters and parameters are saved in the dictionary *shared_rasters* of the worker.
+    :rtype: None
+    """
+    shared_rasters["rasters"] = {key: np.load(path, mmap_mode="r") for key, path in raster_files.items()}
+    shared_rasters["other_keys"] = other_keys
+    shared_rasters["param"] = {key: param[key] for key in ["Crd_all", "res_desired", "GeoRef"]}
+    mask_cache.cache.update(cache)
+
+
+def zonal_stats_worker(regions_shp):
+    """
+    This function calculates the zonal statistics of a chunk of regions in a worker process of :mod:`zonal_stats`.
+
+    :param regions_shp: Geodataframe containing the chunk of regions.
+    :type regions_shp: geodataframe
+
+    :return: The statistics of each region of the chunk (see :mod:`zonal_stats_region`), and the numbers of hits and misses of the cache of
+        region masks in this chunk.
+    :rtype: tuple(list, int, int)
+    """
+    hits = mask_cache.cache["hits"]
+    misses = mask_cache.cache["misses"]
+    stats = []
+    for reg in range(0, len(regions_shp)):
+        stats.append(zonal_stats_region(regions_shp.iloc[reg], shared_rasters["rasters"], shared_rasters["other_keys"], shared_rasters["param"]))
+    return stats, mask_cache.cache["hits"] - hits, mask_cache.cache["misses"] - misses
+
+
+def zonal_stats_label_raster(regions_shp, raster_dict, other_keys, df, param):
+    """
+    This function calculates the zonal statistics of :mod:`zonal_stats` for all regions in one vectorized pass. The regions are rasterized once
+    into rasters of region IDs using :mod:`calc_region_labels`, then the statistics are reduced by region ID (sums and counts with ``np.bincount``,
+    maxima with ``np.fmax.reduceat``). The rasters are processed in stripes of *zonal_stats_stripe* rows to limit the size of the temporary arrays.
+    The sums are accumulated in float64 in a fixed order, which :mod:`zonal_stats_region` follows as well, so that both modes give identical results.
+
+    :param regions_shp: Geodataframe containing the regions for which the statistics should be calculated.
+    :type regions_shp: geodataframe
+    :param raster_dict: Dictionary with keys *Population*, *Landuse*, or any other string, and with the rasters (numpy arrays) as values.
+    :type raster_dict: dict
+    :param other_keys: Keys of *raster_dict* for which the maximum is calculated.
+    :type other_keys: list
+    :param df: Empty dataframe of statistics, with one row per region.
+    :type df: pandas dataframe
+    :param param: Dictionary containing *Crd_all*, *res_desired*, and *GeoRef*.
+    :type param: dict
+
+    :return df: Dataframe containing the zonal statistics, with the names of the regions as index and the keys of the statistics as columns.
+    :rtype: pandas dataframe
+    """
+    nRegions = len(regions_shp)
+    layers = calc_region_labels(regions_shp, param["Crd_all"], param["res_desired"], param["GeoRef"])
+
+    pop_sum = np.zeros(nRegions + 1)
+    max_values = {key: np.full(nRegions + 1, np.nan) for key in other_keys}
+    if "Landuse" in raster_dict.keys():
+        A_lu = raster_dict["Landuse"]
+        lu_min = int(A_lu.min())
+        n_lu = int(A_lu.max()) - lu_min + 1
+        lu_counts = np.zeros((nRegions + 1) * n_lu, dtype=np.int64)
+
+    stripe = zonal_stats_stripe
+    status = 0
+    length = len(layers) * int(math.ceil(layers[0].shape[0] / stripe)) if len(layers) else 0
+    for A_labels in layers:
+        for row in range(0, A_labels.shape[0], stripe):
+            rows = slice(row, row + stripe)
+            labels = A_labels[rows].ravel().astype(np.intp)
+
+            if "Population" in raster_dict.keys():
+                A_pop = raster_dict["Population"][rows].ravel()
+                pop_sum = pop_sum + np.bincount(labels, weights=np.where(np.isnan(A_pop), 0, A_pop), minlength=nRegions + 1)
+
+            if "Landuse" in raster_dict.keys():
+                lu_counts = lu_counts + np.bincount(labels * n_lu + (A_lu[rows].ravel().astype(np.intp) - lu_min), minlength=(nRegions + 1) * n_lu)
+
+            if len(other_keys):
+                inside = np.flatnonzero(labels)
+                order = np.argsort(labels[inside], kind="stable")
+                sorted_labels = labels[inside][order]
+                starts = np.flatnonzero(np.r_[True, np.diff(sorted_labels) != 0]) if len(sorted_labels) else np.array([], dtype=int)
+                for key in other_keys:
+                    if not len(starts):
+                        continue
+                    values = raster_dict[key][rows].ravel()[inside][order]
+                    ids = sorted_labels[starts]
+                    max_values[key][ids] = np.fmax(max_values[key][ids], np.fmax.reduceat(values, starts))
+
+            # Show status bar
+            status = status + 1
+            display_progress("Calculating statistics ", (length, status))
+
+    # Fill the dataframe (label 0 is the background)
+    if "Population" in raster_dict.keys():
+        df["RES"] = pop_sum[1:]
+    if "Landuse" in raster_dict.keys():
+        lu_counts = lu_counts.reshape((nRegions + 1, n_lu))[1:]
+        for element in np.flatnonzero(lu_counts.sum(axis=0)):
+            df[str(int(element + lu_min))] = lu_counts[:, element]
+    for key in other_keys:
+        df[key] = max_values[key][1:]
+
     return df
 
 
@@ -348,6 +822,7 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
     """
     This module iterates over the countries in the IRENA summary report, applies a mask of each country on a raster of potential of the technology *tech* that
     spans over the whole geographic scope, and calculates a probability distribution for that country which takes into account the potential but also a random factor.
+    Only the pixels of the country, within its bounding box, are considered, and the random factor is drawn from a generator seeded with *seed* in *dist_ren*.
     It selects the pixels with the highest probabilities, such that the number of pixels is equal to the number of units in that country and for that technology.
     After deriving the coordinates of those pixels, it saves them into a shapefile of points for each technology.
     
@@ -384,11 +859,14 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
         if not os.path.exists(paths["PA"]):
             generate_protected_areas(paths, param)
         with rasterio.open(paths["PA"]) as src:
-            A_protect = np.flipud(src.read(1)).astype(int)
-        raster = changem(A_protect, param["dist_ren"]["default_pa_availability"], param["dist_ren"]["default_pa_type"]).astype(float)
+            A_protect = np.flipud(src.read(1))
+        raster = changem(A_protect, param["dist_ren"]["default_pa_availability"], param["dist_ren"]["default_pa_type"])
+
+    # Random numbers for the distribution, reproducible for a given seed and different for each technology
+    seed = param["dist_ren"]["seed"]
+    rng = np.random.default_rng(None if seed is None else [seed, int(hashlib.sha1(tech.encode()).hexdigest()[:8], 16)])
 
     status = 0
-    ind_needed = {}
     x = y = p = c = []
     length = len(inst_cap["Country/area"].unique())
     for reg in inst_cap["Country/area"].unique():
@@ -405,16 +883,18 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
         if tech == "WindOff":
             regions_shp = param["regions_sea"]
             mask = regions_shp.loc[regions_shp["ISO_Ter1"] == reg].dissolve(by="ISO_Ter1").squeeze()
-            A_region_extended = calc_region(mask, Crd_all, res_desired, GeoRef)
         else:
             regions_shp = param["regions_land"]
             mask = regions_shp.loc[regions_shp["GID_0"] == reg].squeeze()
-            A_region_extended = calc_region(mask, Crd_all, res_desired, GeoRef)
-        A_region_extended[A_region_extended == 0] = np.nan
+        A_region, window = calc_region_window(mask, Crd_all, res_desired, GeoRef)
 
-        # Calculate potential distribution
-        distribution = A_region_extended * raster
-        potential = distribution.flatten()
+        # Keep only the pixels of the region, within its window
+        rows, cols = np.nonzero(A_region)
+        if not len(rows):
+            warn("No pixels of " + reg + " are within the scope, its capacities of " + tech + " are not distributed.", UserWarning)
+            status = status + 1
+            continue
+        potential = raster[window][rows, cols].astype(float)
 
         # Calculate the part of the probability that is based on the potential
         potential_nan = np.isnan(potential) | (potential == 0)
@@ -425,15 +905,19 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
         potential[potential_nan] = 0
 
         # Calculate the random part of the probability
-        potential_random = np.random.random_sample(potential.shape)
+        potential_random = rng.random(potential.shape)
         potential_random[potential_nan] = 0
 
         # Combine the two parts
         potential_new = (1 - param["dist_ren"]["randomness"]) * potential + param["dist_ren"]["randomness"] * potential_random
 
-        # Sort elements based on their probability and keep the indices
-        ind_sort = np.argsort(potential_new, axis=None)  # Ascending
-        ind_needed = ind_sort[-int(inst_cap.loc[(inst_cap["Country/area"] == reg) & (inst_cap["Technology"] == tech), "Units"].values) :]
+        # Select the pixels with the highest probabilities, then sort them in ascending order and keep the indices
+        n_units = int(inst_cap.loc[(inst_cap["Country/area"] == reg) & (inst_cap["Technology"] == tech), "Units"].values)
+        if n_units > len(potential_new):
+            warn("There are more units of " + tech + " in " + reg + " than pixels, only one unit per pixel is placed.", UserWarning)
+            n_units = len(potential_new)
+        ind_needed = np.argpartition(potential_new, len(potential_new) - n_units)[len(potential_new) - n_units :]
+        ind_needed = ind_needed[np.argsort(potential_new[ind_needed])]  # Ascending
 
         # Get the coordinates of the power plants and their respective capacities
         power_plants = [units[tech]] * len(ind_needed)
@@ -441,7 +925,8 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
             power_plants[-1] = (
                 inst_cap.loc[(inst_cap["Country/area"] == reg) & (inst_cap["Technology"] == tech), "inst-cap (MW)"].values % units[tech]
             )[0]
-        y_pp, x_pp = np.unravel_index(ind_needed, distribution.shape)
+        y_pp = rows[ind_needed] + window[0].start
+        x_pp = cols[ind_needed] + window[1].start
 
         Crd_y_pp, Crd_x_pp = crd_exact_points((y_pp, x_pp), Crd_all, res_desired)
 
@@ -477,14 +962,97 @@ def create_shapefiles_of_ren_power_plants(paths, param, inst_cap, tech):
     timecheck(tech + " - End")
 
 
+def region_locator(regions, tolerance=0):
+    """
+    This function returns a locator of the regions, made of a spatial index (STRtree) of their geometries and of their prepared geometries,
+    which speed up repeated point-in-polygon tests. The locator is cached in memory with a hash of the names and geometries of the regions and
+    of the tolerance, so that it is only built once for the same regions. If *tolerance* is greater than 0, the geometries are simplified
+    before being indexed, which is faster but less accurate near the borders.
+
+    :param regions: Geodataframe of the regions, with the attribute *NAME_SHORT*.
+    :type regions: geodataframe
+    :param tolerance: Tolerance of the simplification, in the unit of the coordinates of the regions.
+    :type tolerance: float
+
+    :return locator: Dictionary with the spatial index *tree*, the prepared geometries *prepared*, the *names* of the regions, the
+        dictionary *index* of the position of each indexed geometry, and the *bounds* of the geometries.
+    :rtype: dict
+    """
+    h = hashlib.sha1(str(tolerance).encode())
+    for name, geom in zip(regions["NAME_SHORT"], regions["geometry"]):
+        h.update(str(name).encode())
+        h.update(geom.wkb)
+    key = h.hexdigest()
+    if key not in region_locators:
+        geoms = [geom.simplify(tolerance) if tolerance > 0 else geom for geom in regions["geometry"]]
+        region_locators[key] = {
+            "tree": STRtree(geoms),
+            "prepared": [prep(geom) for geom in geoms],
+            "names": np.array(regions["NAME_SHORT"], dtype=object),
+            "index": {id(geom): i for i, geom in enumerate(geoms)},
+            "bounds": np.array([geom.bounds for geom in geoms]).reshape((-1, 4)),
+        }
+    return region_locators[key]
+
+
+def locate_points(lon, lat, regions, tolerance=0):
+    """
+    This function finds the region in which each point lies, for all the points at once. For each region, the points within its bounding box
+    are found in the points sorted by longitude, and tested all together against its prepared geometry. The remaining points, e.g. on the
+    border between two regions, are tested individually with the intersection test against the candidates of the spatial index
+    (see :mod:`region_locator`). Points that lie in several regions are allocated to the first of them.
+
+    :param lon: Longitudes (or x coordinates) of the points, in the coordinate system of the regions.
+    :type lon: numpy array
+    :param lat: Latitudes (or y coordinates) of the points, in the coordinate system of the regions.
+    :type lat: numpy array
+    :param regions: Geodataframe of the regions, with the attribute *NAME_SHORT*.
+    :type regions: geodataframe
+    :param tolerance: Tolerance of the simplification of the regions (see :mod:`region_locator`).
+    :type tolerance: float
+
+    :return names: Name of the region of each point, or ``None`` if the point does not lie in any region.
+    :rtype: numpy array
+    """
+    locator = region_locator(regions, tolerance)
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    order = np.argsort(lon, kind="mergesort")
+    lon_sorted = lon[order]
+    found = np.full(len(lon), -1)
+
+    # Points within the interior of each region, tested in batches
+    for r in range(0, len(locator["names"])):
+        W, S, E, N = locator["bounds"][r]
+        candidates = order[np.searchsorted(lon_sorted, W, side="left") : np.searchsorted(lon_sorted, E, side="right")]
+        candidates = candidates[(lat[candidates] >= S) & (lat[candidates] <= N) & (found[candidates] < 0)]
+        if len(candidates):
+            found[candidates[vectorized.contains(locator["prepared"][r], lon[candidates], lat[candidates])]] = r
+
+    # Remaining points within the extent of the regions, tested one by one (including the borders)
+    W, S, E, N = locator["bounds"][:, 0].min(), locator["bounds"][:, 1].min(), locator["bounds"][:, 2].max(), locator["bounds"][:, 3].max()
+    for i in np.nonzero((found < 0) & (lon >= W) & (lon <= E) & (lat >= S) & (lat <= N))[0]:
+        point = Point(lon[i], lat[i])
+        # The spatial index returns positions (Shapely 2) or geometries (Shapely 1)
+        candidates = sorted(c if isinstance(c, (int, np.integer)) else locator["index"][id(c)] for c in locator["tree"].query(point))
+        for c in candidates:
+            if locator["prepared"][c].intersects(point):
+                found[i] = c
+                break
+
+    names = np.full(len(lon), None, dtype=object)
+    names[found >= 0] = locator["names"][found[found >= 0]]
+    return names
+
+
 def get_sites(points_shp, param):
     """
-    This function reads a shapefile of points, then performs a spatial join with a shapefile of regions to associate the names
+    This function reads a shapefile of points, then locates them in the regions (see :mod:`locate_points`) to associate the names
     of the regions to the attributes of the points. It also removes duplicates and points that lie outside the subregions.
     
     :param points_shp: A shapefile of points (power plants, storage devices, etc.)
     :type points_shp: Geopandas dataframe
-    :param param: Dictionary of user-defined parameters, including the shapefile *regions_sub*.
+    :param param: Dictionary of user-defined parameters, including the shapefile *regions_sub* and the dictionary *locator*.
     :type param: dict
     
     :return located: The shapefile of points that are located within the subregions, with the name of the subregion as an attribute.
@@ -492,11 +1060,9 @@ def get_sites(points_shp, param):
     """
     regions = param["regions_sub"]
 
-    # Spatial join
-    points_shp = points_shp.to_crs(regions.crs)
-    located = gpd.sjoin(points_shp, regions[["NAME_SHORT", "geometry"]], how="left", op="intersects")
-    located.rename(columns={"NAME_SHORT": "Site"}, inplace=True)
-    located.drop(columns=["index_right"], inplace=True)
+    # Locate the points in the regions
+    located = points_shp.to_crs(regions.crs)
+    located["Site"] = locate_points(located.geometry.x.values, located.geometry.y.values, regions, param["locator"]["tolerance"])
 
     # Remove duplicates that lie in the border between two regions
     located = located.drop_duplicates(subset=["Name"], inplace=False)
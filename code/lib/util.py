@@ -5,92 +5,218 @@ from warnings import warn
 import inspect
 import datetime
 import math
+import shutil
+import tempfile
+from multiprocessing import Pool
 import numpy as np
-from numpy.matlib import repmat, reshape
 import pandas as pd
+from scipy import sparse
 from osgeo import gdal, ogr, osr, gdal_array
 import rasterio
-from rasterio import MemoryFile, mask, windows
-from geopy import distance
+from rasterio import MemoryFile, mask, windows, features
 import shapefile as shp
-import pysal as ps
 from shapely import geometry
 from shapely.geometry import Polygon, Point
+from shapely.strtree import STRtree
+from shapely.prepared import prep
+from shapely import vectorized
 import geopandas as gpd
 import re
 import json
+import hashlib
 
 warnings.simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
 
 
-def get_sectoral_profiles(paths, param):
+# Sectoral load profiles published in this process, keyed by (year, sector, hash of the source files)
+profile_registry = {}
+# Hashes of the source files, keyed by (path, size, modification time), so that unchanged files are not hashed again
+source_hashes = {}
+
+
+def file_hash(filepath):
     """
-    This function reads the raw standard load profiles, repeats them to obtain a full year, normalizes them so that the
-    sum is equal to 1, and stores the obtained load profile for each sector in the dataframe *profiles*.
+    This function returns the SHA-1 hash of the content of a file. The hash is only calculated again if the size or the modification
+    time of the file have changed since the last call.
 
-    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
+    :param filepath: Path to the file.
+    :type filepath: string
+
+    :return: Hexadecimal hash of the file.
+    :rtype: string
+    """
+    stat = os.stat(filepath)
+    key = (filepath, stat.st_size, stat.st_mtime)
+    if key not in source_hashes:
+        h = hashlib.sha1()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(1024 ** 2), b""):
+                h.update(block)
+        source_hashes[key] = h.hexdigest()
+    return source_hashes[key]
+
+
+def read_source(paths, param, reader, filepath, **kwargs):
+    """
+    This function parses a raw input with a pandas reader, e.g. ``pd.read_excel`` or ``pd.read_csv``, and caches the result as an HDF5 file
+    in the folder *source_cache*. The cache is keyed by the content hash of the raw input (see :mod:`file_hash`, which only hashes the file again
+    if its path, size or modification time have changed), by the reader, its source code and the version of pandas, and by its arguments, except
+    *chunksize*, which only bounds the memory used while parsing. In the next runs, the cached dataframe is read instead of parsing the raw input
+    again. If the reader returns a tuple of dataframes, each of them is cached in the same file.
+
+    :param paths: Dictionary including the path to the folder *source_cache*.
     :type paths: dict
-    :param param: Dictionary containing the *year* and load-related assumptions.
+    :param param: Dictionary including the dictionary *source_cache*.
     :type param: dict
+    :param reader: Pandas function to parse the raw input.
+    :type reader: function
+    :param filepath: Path to the raw input.
+    :type filepath: string
+    :param kwargs: Arguments of the reader.
 
-    :return profiles: The normalized load profiles for the sectors.
-    :rtype: pandas dataframe
+    :return df: The parsed raw input.
+    :rtype: pandas dataframe or tuple of pandas dataframes
     """
-    timecheck("Start")
-    profiles_paths = paths["cleaned_profiles"]
+    if not param["source_cache"]["enabled"]:
+        return reader(filepath, **kwargs)
+
+    try:
+        reader_source = inspect.getsource(reader)
+    except (OSError, TypeError):
+        reader_source = getattr(reader, "__module__", "") + "." + reader.__name__
+    key_args = sorted((k, v) for k, v in kwargs.items() if k != "chunksize")
+    h = hashlib.sha1((file_hash(filepath) + reader.__name__ + reader_source + pd.__version__ + repr(key_args)).encode())
+    cache_path = paths["source_cache"] + os.path.splitext(os.path.basename(filepath))[0] + "_" + h.hexdigest()[:16] + ".h5"
+    if os.path.isfile(cache_path):
+        with pd.HDFStore(cache_path, mode="r") as store:
+            if "/data" in store.keys():
+                return store["data"]
+            return tuple(store["data_" + str(i)] for i in range(len(store.keys())))
+
+    df = reader(filepath, **kwargs)
+    try:
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="object name is not a valid Python identifier")
+            if isinstance(df, tuple):
+                with pd.HDFStore(cache_path, mode="w") as store:
+                    for i in range(len(df)):
+                        store.put("data_" + str(i), df[i], format="fixed")
+            else:
+                df.to_hdf(cache_path, key="data", mode="w", format="fixed")
+    except (TypeError, ValueError, OSError) as e:
+        warn("The parsed input " + filepath + " could not be cached: " + str(e), UserWarning)
+        if os.path.isfile(cache_path):
+            os.remove(cache_path)
+    return df
+
+
+def profile_key(paths, year, sector):
+    """
+    This function returns the key of a sectoral load profile in the profile registry. It consists of the year, the sector, and a hash of
+    the raw standard load profile of the sector and of the calendar dictionaries *dict_daytype* and *dict_season*.
 
-    # Prepare the dataframe for the yearly load per sector
-    profiles = pd.DataFrame(columns=param["load"]["sectors"])
+    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, and to the raw standard load profiles.
+    :type paths: dict
+    :param year: Year of the profile.
+    :type year: integer
+    :param sector: Name of the sector.
+    :type sector: string
 
-    # Residential load
-    if "RES" in param["load"]["sectors"]:
-        profiles["RES"] = pd.read_csv(profiles_paths["RES"], sep=";", decimal=",", header=[0], index=[0]).to_numpy()
+    :return key: Key of the profile.
+    :rtype: tuple(int, string, string)
+    """
+    h = hashlib.sha1()
+    for filepath in [paths["profiles"][sector], paths["dict_daytype"], paths["dict_season"]]:
+        h.update(file_hash(filepath).encode())
+    return int(year), sector, h.hexdigest()
 
-    # Industrial load
-    if "IND" in param["load"]["sectors"]:
-        profiles["IND"] = pd.read_csv(profiles_paths["IND"], sep=";", decimal=",", header=[0], index=[0]).to_numpy()
 
-    # Commercial load
-    if "COM" in param["load"]["sectors"]:
-        profiles["COM"] = pd.read_csv(profiles_paths["COM"], sep=";", decimal=",", header=[0], index=[0]).to_numpy()
+def profile_registry_path(paths, key):
+    """
+    This function returns the path of a sectoral load profile in the on-disk backing of the profile registry.
 
-    # Agricultural load
-    if "AGR" in param["load"]["sectors"]:
-        profiles["AGR"] = pd.read_csv(profiles_paths["AGR"], sep=";", decimal=",", header=[0], index=[0]).to_numpy()
+    :param paths: Dictionary including the path to the folder *profile_registry*.
+    :type paths: dict
+    :param key: Key of the profile, as returned by :mod:`profile_key`.
+    :type key: tuple(int, string, string)
 
-    # Street lights
-    if "STR" in param["load"]["sectors"]:
-        profiles["STR"] = pd.read_csv(profiles_paths["STR"], sep=";", decimal=",", header=[0], index=[0]).to_numpy()
-    timecheck("End")
-    return profiles
+    :return: Path to the HDF5 file of the profile.
+    :rtype: string
+    """
+    year, sector, h = key
+    return paths["profile_registry"] + sector + "_" + str(year) + "_" + h[:16] + ".h5"
 
 
-def resizem(A_in, row_new, col_new):
+def publish_profile(paths, param, sector, profile):
     """
-    This function resizes regular data grid, by copying and pasting parts of the original array.
+    This function publishes the cleaned load profile of a sector for the year *year* into the profile registry, so that it can be used by the
+    following steps without reading the CSV file of the cleaned profile. If *registry_on_disk* in the dictionary *load* is True, the profile
+    is also saved in the folder *profile_registry*, to be reused by the next runs as long as the source files do not change.
 
-    :param A_in: Input matrix.
-    :type A_in: numpy array
-    :param row_new: New number of rows.
-    :type row_new: integer
-    :param col_new: New number of columns.
-    :type col_new: integer
+    :param paths: Dictionary containing the paths to the raw standard load profiles, to *dict_daytype*, *dict_season*, and to *profile_registry*.
+    :type paths: dict
+    :param param: Dictionary containing the *year* and the dictionary *load*.
+    :type param: dict
+    :param sector: Name of the sector.
+    :type sector: string
+    :param profile: Normalized hourly load profile of the sector.
+    :type profile: numpy array
 
-    :return A_out: Resized matrix.
-    :rtype: numpy array
+    :return: The profile is published.
+    :rtype: None
     """
-    row_rep = row_new // np.shape(A_in)[0]
-    col_rep = col_new // np.shape(A_in)[1]
-    A_inf = A_in.flatten(order="F")[np.newaxis]
-    A_out = reshape(
-        repmat(
-            reshape(reshape(repmat((A_in.flatten(order="F")[np.newaxis]), row_rep, 1), (row_new, -1), order="F").T, (-1, 1), order="F"), 1, col_rep
-        ).T,
-        (col_new, row_new),
-        order="F",
-    ).T
+    key = profile_key(paths, param["year"], sector)
+    profile_registry[key] = np.asarray(profile, dtype=float)
+    if param["load"]["registry_on_disk"]:
+        if not os.path.isdir(paths["profile_registry"]):
+            os.makedirs(paths["profile_registry"])
+        pd.Series(profile_registry[key], name=sector).to_hdf(profile_registry_path(paths, key), key="data", mode="w", format="fixed")
 
-    return A_out
+
+def lookup_profile(paths, param, sector):
+    """
+    This function returns the cleaned load profile of a sector for the year *year* from the profile registry. The profiles published in this
+    process are returned directly, otherwise the on-disk backing is read, if *registry_on_disk* in the dictionary *load* is True.
+
+    :param paths: Dictionary containing the paths to the raw standard load profiles, to *dict_daytype*, *dict_season*, and to *profile_registry*.
+    :type paths: dict
+    :param param: Dictionary containing the *year* and the dictionary *load*.
+    :type param: dict
+    :param sector: Name of the sector.
+    :type sector: string
+
+    :return: The normalized hourly load profile of the sector, or ``None`` if it is not in the registry or if its source files have changed.
+    :rtype: numpy array or None
+    """
+    key = profile_key(paths, param["year"], sector)
+    if key not in profile_registry and param["load"]["registry_on_disk"] and os.path.isfile(profile_registry_path(paths, key)):
+        profile_registry[key] = pd.read_hdf(profile_registry_path(paths, key), key="data").values
+    return profile_registry.get(key)
+
+
+def get_sectoral_profiles(paths, param):
+    """
+    This function returns the cleaned load profile of each sector for the year *year*, normalized so that its sum is equal to 1.
+    The profiles are taken from the profile registry (see :mod:`lookup_profile`). If a profile is not in the registry, the CSV file of the
+    cleaned profile is read instead.
+
+    :param paths: Dictionary containing the paths to *dict_daytype*, *dict_season*, to the raw standard load profiles, and to the cleaned profiles.
+    :type paths: dict
+    :param param: Dictionary containing the *year* and load-related assumptions.
+    :type param: dict
+
+    :return profiles: The normalized load profiles for the sectors.
+    :rtype: pandas dataframe
+    """
+    timecheck("Start")
+    profiles = pd.DataFrame()
+    for sector in paths["cleaned_profiles"].keys():
+        profile = lookup_profile(paths, param, sector)
+        if profile is None:
+            profile = pd.read_csv(paths["cleaned_profiles"][sector], sep=";", decimal=",", index_col=0)[sector].values
+        profiles[sector] = profile
+    timecheck("End")
+    return profiles
 
 
 def timecheck(*args):
@@ -136,21 +262,29 @@ def display_progress(message, progress_stat):
         print("\n")
 
 
-def reverse_lines(df):
+def reverse_lines(df, pairs=None):
     """
-    This function reverses the line direction if the starting point is alphabetically
-    after the end point.
+    This function reverses the line direction if the starting point is alphabetically after the end point, for all the lines at once.
+    The direction-dependent attributes, by default the coordinates of the start and end points, are swapped with the regions.
 
     :param df: Dataframe with columns 'Region_start' and 'Region_end'.
     :type df: pandas dataframe
+    :param pairs: Pairs of columns (start, end) to be swapped for the reversed lines. By default, the regions and the coordinates
+        'V1_long', 'V1_lat', 'V2_long', and 'V2_lat'. Pairs with missing columns are ignored.
+    :type pairs: list of tuples
 
-    :returns df_final: The same dataframe after the line direction has been reversed.
+    :returns df_final: A copy of the dataframe after the line direction has been reversed.
     :rtype: pandas dataframe
     """
-    for idx in df.index:
-        if df.Region_start[idx] > df.Region_end[idx]:
-            df.loc[idx, "Region_start"], df.loc[idx, "Region_end"] = df.loc[idx, "Region_end"], df.loc[idx, "Region_start"]
-    df_final = df
+    if pairs is None:
+        pairs = [("Region_start", "Region_end"), ("V1_long", "V2_long"), ("V1_lat", "V2_lat")]
+    reverse = df["Region_start"].values > df["Region_end"].values
+
+    df_final = df.copy()
+    for start, end in pairs:
+        if start in df.columns and end in df.columns:
+            df_final[start] = np.where(reverse, df[end].values, df[start].values)
+            df_final[end] = np.where(reverse, df[start].values, df[end].values)
 
     return df_final
 
@@ -352,3 +486,203 @@ def create_json(filepath, param, param_keys, paths, paths_keys):
     with open(new_file, "w") as json_file:
         json.dump(new_dict, json_file)
     print("File saved: " + new_file)
+
+
+def intermediate_path(filepath, param):
+    """
+    This function returns the path of the binary version of an intermediate file, depending on *format* in the dictionary *intermediate*.
+    The path of the CSV version is kept in the dictionary *paths*, and only its extension is replaced.
+
+    :param filepath: Path to the CSV version of the intermediate file.
+    :type filepath: string
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+
+    :return path: Path to the file in the selected format.
+    :rtype: string
+    """
+    if param["intermediate"]["format"] == "hdf5":
+        return os.path.splitext(filepath)[0] + ".h5"
+    return filepath
+
+
+def intermediate_exists(filepath, param):
+    """
+    This function checks whether an intermediate file exists in the selected format.
+
+    :param filepath: Path to the CSV version of the intermediate file.
+    :type filepath: string
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+
+    :return: True if the file exists.
+    :rtype: bool
+    """
+    return os.path.isfile(intermediate_path(filepath, param))
+
+
+def save_intermediate(df, filepath, param, index=True):
+    """
+    This function saves an intermediate dataframe or series in the format selected in the dictionary *intermediate*:
+
+      * ``'hdf5'``: binary HDF5 file, which keeps the index, the MultiIndex columns and the data types, and is much faster to read and write.
+      * ``'csv'``: CSV file with semicolons and decimal commas.
+
+    If *csv_export* is True, a CSV file is saved in addition to the HDF5 file, as a human-readable copy.
+
+    :param df: Dataframe or series to be saved.
+    :type df: pandas dataframe or series
+    :param filepath: Path to the CSV version of the intermediate file.
+    :type filepath: string
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+    :param index: If False, the index is not saved in CSV files (it is always kept in HDF5 files).
+    :type index: bool
+
+    :return: The file is saved.
+    :rtype: None
+    """
+    if param["intermediate"]["format"] == "hdf5":
+        with warnings.catch_warnings():
+            # Names of indices with spaces, e.g. "Land use", are valid but trigger a warning in PyTables
+            warnings.filterwarnings("ignore", message="object name is not a valid Python identifier")
+            df.to_hdf(intermediate_path(filepath, param), key="data", mode="w", format="fixed")
+        print("File saved: " + intermediate_path(filepath, param))
+    if param["intermediate"]["format"] == "csv" or param["intermediate"]["csv_export"]:
+        df.to_csv(filepath, sep=";", decimal=",", index=index, header=True)
+        print("File saved: " + filepath)
+
+
+def read_intermediate(filepath, param, **kwargs):
+    """
+    This function reads an intermediate dataframe saved with :mod:`save_intermediate`. The keyword arguments are only used to read CSV files,
+    since HDF5 files already contain the index and the header.
+
+    :param filepath: Path to the CSV version of the intermediate file.
+    :type filepath: string
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+
+    :return df: The dataframe or series.
+    :rtype: pandas dataframe or series
+    """
+    if param["intermediate"]["format"] == "hdf5":
+        return pd.read_hdf(intermediate_path(filepath, param), key="data")
+    return pd.read_csv(filepath, sep=";", decimal=",", **kwargs)
+
+
+def save_load_factors(filepath, weights, regions, countries, rows):
+    """
+    This function saves the factors of the load time series of the subregions, instead of the time series themselves. The load of the subregions
+    is the product of a sparse matrix of *weights* (subregions x (countries, land use types and RES)) with the hourly load of each land use
+    pixel and of each person in each country (*load_landuse*), which is saved separately. See :mod:`read_load_regions`.
+
+    :param filepath: Path to the NPZ file of the factors.
+    :type filepath: string
+    :param weights: Sparse matrix of the number of pixels of each land use type and of persons in each subregion, per country.
+    :type weights: scipy sparse matrix
+    :param regions: Names of the subregions (rows of *weights*).
+    :type regions: list
+    :param countries: Names of the countries, in the order of the columns of *weights*.
+    :type countries: list
+    :param rows: Land use types and RES, in the order of the columns of *weights* within each country.
+    :type rows: list
+
+    :return: The NPZ file is saved.
+    :rtype: None
+    """
+    weights = weights.tocsr()
+    np.savez_compressed(
+        filepath,
+        data=weights.data,
+        indices=weights.indices,
+        indptr=weights.indptr,
+        shape=np.array(weights.shape),
+        regions=np.array(regions, dtype=str),
+        countries=np.array(countries, dtype=str),
+        rows=np.array(rows, dtype=str),
+    )
+    print("File saved: " + filepath)
+
+
+def read_load_factors(paths, param, regions=None):
+    """
+    This function reads the factors of the load of the subregions saved by :mod:`save_load_factors`, and the load of each land use pixel and
+    of each person in each country, in the order of the columns of the weights.
+
+    :param paths: Dictionary including the paths *load_regions_factors* and *load_landuse*.
+    :type paths: dict
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+    :param regions: Names of the subregions to be read. If None, all the subregions are read.
+    :type regions: list
+
+    :return (weights, regions, load_units): Sparse matrix of weights (one row per subregion), names of the subregions, and array of the
+        hourly load per unit (one row per column of the weights).
+    :rtype: tuple(scipy sparse matrix, list, numpy array)
+    """
+    with np.load(paths["load_regions_factors"]) as f:
+        weights = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+        all_regions = f["regions"].tolist()
+        countries = f["countries"].tolist()
+        rows = f["rows"].tolist()
+    if regions is not None:
+        weights = weights[[all_regions.index(r) for r in regions]]
+    else:
+        regions = all_regions
+    load_landuse = read_intermediate(paths["load_landuse"], param, index_col=[0, 1])
+    load_units = load_landuse.loc[pd.MultiIndex.from_product([countries, rows])].values.astype(param["intermediate"]["ts_dtype"], copy=False)
+    return weights, regions, load_units
+
+
+def read_load_regions(paths, param, regions=None, chunk=500):
+    """
+    This function returns the hourly load of the subregions. If the factors of the load have been saved (see :mod:`save_load_factors`),
+    the time series are computed from them in chunks of *chunk* subregions, and only for the desired *regions*. Otherwise, the time series
+    are read from the file *load_regions*.
+
+    :param paths: Dictionary including the paths *load_regions_factors*, *load_landuse* and *load_regions*.
+    :type paths: dict
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+    :param regions: Names of the subregions to be returned. If None, all the subregions are returned.
+    :type regions: list
+    :param chunk: Number of subregions computed at once.
+    :type chunk: integer
+
+    :return load_regions: Hourly load with one column per subregion, or None if the load of the subregions has not been generated.
+    :rtype: pandas dataframe
+    """
+    if not os.path.isfile(paths["load_regions_factors"]):
+        if not intermediate_exists(paths["load_regions"], param):
+            return None
+        load_regions = read_intermediate(paths["load_regions"], param, index_col=0)
+        return load_regions if regions is None else load_regions[regions]
+
+    weights, regions, load_units = read_load_factors(paths, param, regions)
+    weights = weights.astype(load_units.dtype)
+    load_regions = np.zeros((len(regions), load_units.shape[1]), dtype=load_units.dtype)
+    for row in range(0, len(regions), chunk):
+        load_regions[row : row + chunk] = weights[row : row + chunk].dot(load_units)
+    return pd.DataFrame(load_regions.T, index=pd.RangeIndex(load_units.shape[1]), columns=pd.Index(regions, name="Region"))
+
+
+def read_load_regions_annual(paths, param):
+    """
+    This function returns the yearly load of each subregion. If the factors of the load have been saved (see :mod:`save_load_factors`),
+    it is computed directly from the yearly load per unit, without the time series of the subregions.
+
+    :param paths: Dictionary including the paths *load_regions_factors*, *load_landuse* and *load_regions*.
+    :type paths: dict
+    :param param: Dictionary including the dictionary *intermediate*.
+    :type param: dict
+
+    :return annual: Yearly load of each subregion.
+    :rtype: pandas series
+    """
+    if not os.path.isfile(paths["load_regions_factors"]):
+        load_regions = read_intermediate(paths["load_regions"], param, index_col=0)
+        return pd.Series(load_regions.values.sum(axis=0, dtype=np.float64), index=load_regions.columns)
+
+    weights, regions, load_units = read_load_factors(paths, param)
+    return pd.Series(weights.dot(load_units.sum(axis=1, dtype=np.float64)), index=pd.Index(regions, name="Region"))
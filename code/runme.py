@@ -2,16 +2,13 @@ from lib.initialization import initialization
 from lib.generate_intermediate_files import *
 from lib.correction_functions import *
 from lib.generate_models import *
+from lib.mask_cache import report_mask_cache
 
 if __name__ == "__main__":
     paths, param = initialization()
 
     ## Clean raw data
-    clean_residential_load_profile(paths, param)
-    clean_commercial_load_profile(paths, param)
-    clean_industry_load_profile(paths, param)
-    clean_agriculture_load_profile(paths, param)
-    clean_streetlight_load_profile(paths, param)
+    clean_load_profiles(paths, param)
     clean_GridKit_Europe(paths, param)
     clean_sector_shares_Eurostat(paths, param)
     clean_load_data_ENTSOE(paths, param)
@@ -30,3 +27,5 @@ if __name__ == "__main__":
     ## Generate model files
     generate_urbs_model(paths, param)
     generate_evrys_model(paths, param)
+
+    report_mask_cache()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are imported as in runme.py, from the folder code
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
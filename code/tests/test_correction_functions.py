@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from lib.correction_functions import read_GridKit
+from lib.util import expand_dataframe
+
+
+def test_read_GridKit_chunks(tmp_path):
+    path = str(tmp_path / "gridkit.csv")
+    pd.DataFrame(
+        {
+            "l_id": [1, 2, 3],
+            "voltage": ["380000", "220000;110000", "380000"],
+            "cables": ["3", "6;3", "6"],
+            "wires": ["2", "1;1", "4"],
+            "frequency": ["50", "50;50", "50"],
+            "name": ["a", "b", "c"],
+            "length_m": [71000, np.nan, 0],
+            "wkt_srid_4326": [
+                "SRID=4326;LINESTRING(10 50,11 50)",
+                "SRID=4326;LINESTRING(10 50,10.5 50, 11 50.5)",
+                "SRID=4326;LINESTRING(5 45,6 46)",
+            ],
+        }
+    ).to_csv(path, index=False)
+
+    # The result does not depend on the number of rows read at once
+    grid_one, vertices_one = read_GridKit(path, chunksize=1)
+    grid_all, vertices_all = read_GridKit(path, chunksize=10)
+    pd.testing.assert_frame_equal(grid_one, grid_all)
+    pd.testing.assert_frame_equal(vertices_one, vertices_all)
+
+    expanded = expand_dataframe(grid_one, ["voltage", "wires", "cables", "frequency"])
+    line = expanded.loc[(expanded["l_id"] == 1) & expanded["voltage"].notnull()]
+    assert line[["voltage", "wires", "cables", "frequency"]].values.tolist() == [[380000, 2, 3, 50]]
+    assert expanded.loc[expanded["l_id"] == 2, "voltage"].tolist() == [220000, 110000]
+    assert vertices_one.loc[2].values.tolist() == [[10, 50], [10.5, 50], [11, 50.5]]
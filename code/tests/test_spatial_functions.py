@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from lib.spatial_functions import array2raster
+
+
+@pytest.mark.parametrize("compression", ["DEFLATE", "ZSTD", "LZW", "PACKBITS"])
+def test_array2raster_mask(tmp_path, compression):
+    if compression not in gdal.GetDriverByName("GTiff").GetMetadataItem("DMD_CREATIONOPTIONLIST"):
+        pytest.skip(compression + " is not supported by this GDAL installation")
+    mask = (np.arange(300 * 260).reshape((300, 260)) % 3 == 0).astype(float)
+    path = str(tmp_path / "mask.tif")
+
+    array2raster(path, [10, 52], 1 / 240, -1 / 240, mask, compression=compression)
+
+    ds = gdal.Open(path)
+    band = ds.GetRasterBand(1)
+    assert band.GetMetadataItem("NBITS", "IMAGE_STRUCTURE") == "1"
+    assert (np.flipud(band.ReadAsArray()) == mask).all()
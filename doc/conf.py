@@ -142,8 +142,6 @@ autodoc_mock_imports = [
     "geopandas",
     "shapely",
     "shapefile",
-    "pysal",
-    "geopy",
     "sys",
     "inspect",
     "scipy",